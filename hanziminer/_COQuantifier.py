@@ -1,80 +1,435 @@
 # -*- encoding:utf8 -*-
 
 from collections import defaultdict, namedtuple, Counter
-from itertools import chain, combinations
-from hanziminer import Tools, Corpus
+from collections.abc import Mapping
+from itertools import chain, combinations, islice
+from hanziminer import Tools, Corpus, Trie
+import multiprocessing
+import os
 import sys
 import re
 import math
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
 
 class COQuantifier:  # co-occurrence
 
-    score_header = ['total_freq', 'observed_cooccurrence', 'expected_cooccurrence', 't_score', 'sLLRatio']
+    score_header = ['total_freq', 'observed_cooccurrence', 'expected_cooccurrence', 't_score', 'sLLRatio', 'pmi', 'npmi', 'dice', 'llr']
+    _engines = ['dict', 'sparse', 'spill']
+    _pair_batch = 10000000      # sparse engine 이 한 번에 만드는 쌍 수
+    _reduce_size = 10000000     # 병렬 counting 에서 shard reducer 가 모아 두었다 합치는 쌍 수
 
     def __init__( self ):
         """"""
 
     def load( self, text_segmented, doc_sep="(\r?\n){2,}", token_sep="[\s]+"  ):
-        self.text = text_segmented
-        self.doc_sep = doc_sep
+        """ text_segmented 는 분절된 text 또는 Corpus ( Corpus.from_file 등 streaming Corpus 는 문서를 하나씩 읽는다 ) """
+        self.token_sep = token_sep
+        if isinstance( text_segmented, Corpus ) and text_segmented.streaming:
+            self.corpus = text_segmented
+            self.text = None
+            self.doc_sep = text_segmented.doc_sep
+            self.docs = None
+            self.doc_size = None
+            return self
+        self.corpus = None
+        self.text = text_segmented.to_string() if isinstance( text_segmented, Corpus ) else text_segmented
+        self.doc_sep = text_segmented.doc_sep if isinstance( text_segmented, Corpus ) else doc_sep
         self.docs = list( map( lambda x: x.strip(), re.split( re.compile( self.doc_sep ), self.text ) ) )
         self.doc_size = len( self.docs )
-        self.token_sep = token_sep
         return self
 
-    def count( self, cutoff=5 ):
-        self._count_freq( cutoff )._count_cooccurrence()
+    def _iter_docs( self ):
+        return self.corpus.iter_texts() if self.corpus is not None else iter( self.docs )
+
+    def count( self, cutoff=5, engine="dict", buffer_size=10000000, spill_dir=None, workers=1, chunk_size=1000 ):
+        """ engine : "dict" ( 문서마다 token 쌍을 dict 에 센다 ),
+                 "sparse" ( token 을 정수 id 로 바꾸어 문서-단어 CSR 행렬을 만들고, 행마다 처음 나온 순서로 쌍 배열을 만들어 희소 행렬로 더한다 ) 또는
+                 "spill" ( 쌍을 buffer_size 쌍 크기의 buffer 에 모아, 차면 정렬해 spill_dir 에 쓰고 마지막에 합친다 )
+            세 engine 모두 한 문서에서 먼저 나온 token 을 a 로 하는 ( a, b ) 쌍에 그 문서의 b 빈도를 더한다 ( 빈도가 같다 )
+            workers : 2 이상이면 dict engine 의 빈도를 process pool 에서 chunk_size 문서씩 나누어 센다 """
+        if engine not in self._engines:
+            raise ValueError( "engine must be one of {}".format( self._engines ) )
+        self.engine = engine
+        # spill engine 은 전체 token list 를 들고 있지 않는다
+        self._count_freq( cutoff, keep_tokens=( engine != "spill" ) )
+        if engine == "sparse":
+            self._count_cooccurrence_sparse()
+        elif engine == "spill":
+            self._count_cooccurrence_spill( buffer_size, spill_dir )
+        elif workers > 1:
+            self._count_cooccurrence_parallel( workers, chunk_size )
+        else:
+            self._count_cooccurrence()
+        if workers > 1 and engine != "dict":
+            print("!!! workers is used only with engine 'dict'. {} engine counted in one process".format( engine ))
         print("# All Tokens were Counted")
         return self
 
-    def _count_freq( self, cutoff=5 ):
+    def _count_freq( self, cutoff=5, keep_tokens=True ):
         """ 전체 단어 빈도 조사 """
-        self.tokens_all = Corpus.tokenize( self.text, self.token_sep )
-        self.token_size = len( self.tokens_all )
-        self.token_freq_all = Counter( self.tokens_all )
+        if self.corpus is not None or not keep_tokens:
+            self.token_freq_all = Counter()
+            self.token_size = 0
+            for doc in self._iter_docs():
+                _tokens = Corpus.tokenize( doc, self.token_sep )
+                self.token_freq_all.update( _tokens )
+                self.token_size += len( _tokens )
+        else:
+            self.tokens_all = Corpus.tokenize( self.text, self.token_sep )
+            self.token_size = len( self.tokens_all )
+            self.token_freq_all = Counter( self.tokens_all )
         self.token_freq = Counter({ x : self.token_freq_all[x] for x in self.token_freq_all if self.token_freq_all[x] >= cutoff })
         self.tokens = list( self.token_freq.keys() )
+        self.token_index = { token: i for i, token in enumerate( self.tokens ) }
+        self.freqs = np.asarray( [ self.token_freq[ token ] for token in self.tokens ], dtype=np.int64 )     # token id 순서의 빈도
         return self
 
     def _count_cooccurrence( self, allow_duplicate_counts=True ): #doc 안에 같이 나오면 같이 등장하는 것으로.
         """ 문단 별 공기어 빈도 누적 (한 문단 안에 중복해 나와도 거듭 카운트) """
-        _cooccurrence = defaultdict(lambda: 0)
+        _cooccurrence = defaultdict(int)
+        _joint = defaultdict(int)     # 문서마다 min( a 빈도, b 빈도 )
         sys.stdout.flush()
         print("# Co-occurrence Counting ... ")
-        for i, doc in enumerate( self.docs ):
+        i = -1
+        for i, doc in enumerate( self._iter_docs() ):
             _lines = re.split(r"\r?\n", doc)
             _count = Counter()
             for line in _lines:
                 _token_candis_all = Corpus.tokenize( line, self.token_sep )
-                _token_candis = [ token for token in _token_candis_all if token in self.tokens]
+                _token_candis = [ token for token in _token_candis_all if token in self.token_index ]
                 _count.update( Counter( _token_candis ) )
             _keys = _count.keys()
             for pair in combinations( _keys, 2 ) :
                 _cooccurrence[ pair ] += _count[ pair[1] ]
-            Tools.print_progress(i+1, self.doc_size, prefix='Progress', suffix='Complete')
+                _joint[ pair ] += min( _count[ pair[0] ], _count[ pair[1] ] )
+            if self.doc_size: Tools.print_progress(i+1, self.doc_size, prefix='Progress', suffix='Complete')
+            else: Tools.print_counter(i+1, prefix='Progress', suffix='documents')
+        if not self.doc_size: Tools.print_counter(i+1, prefix='Progress', suffix='documents', done=True)
         self.cooccurrence = _cooccurrence
+        self.joint_cooccurrence = _joint
+        sys.stdout.flush()
+        print("# Co-occurrence Counting was done. System memory {:.3f} Gb used".format( Tools.get_process_memory()) )
+        return self
+
+    def index( self, cutoff=5 ):
+        """ 전체 쌍을 세지 않고 token -> 문서 postings 만 만든다 ( query() 에서 target 의 공기어만 센다 ) """
+        self._count_freq( cutoff )._build_doc_term()
+        # 열( token ) 별로 문서 id 가 모인 CSC 가 postings 이다
+        self.postings = self.doc_term.tocsc()
+        self.postings.sort_indices()
+        print("# Postings of {} tokens were indexed".format( len( self.tokens ) ))
+        return self
+
+    def query( self, targets, method="t_score", cutoff=1.5 ):
+        """ targets 가 나오는 문서들의 행에서 target 보다 뒤에 처음 나온 token 만 더해 점수를 구한다 ( count() 와 같은 빈도 )
+            target 하나면 report() 와 같은 list, 여럿이면 { target : list } """
+        _targets = [ targets ] if isinstance( targets, str ) else list( targets )
+        rst = {}
+        for target in _targets:
+            a = self.token_index.get( target, -1 )
+            if a < 0:
+                rst[ target ] = []
+                continue
+            _docs = self.postings.indices[ self.postings.indptr[a]:self.postings.indptr[a+1] ]
+            _rows, _ranks = self.doc_term[ _docs ], self.first_rank[ _docs ]
+            _rank_a = np.asarray( _ranks[ :, a ].todense() ).reshape( -1 )
+            _after = _ranks.data > np.repeat( _rank_a, np.diff( _ranks.indptr ) )
+            _observed = np.bincount( _rows.indices[ _after ], weights=_rows.data[ _after ], minlength=len( self.tokens ) ).astype( np.int64 )
+            _count_a = np.repeat( np.asarray( _rows[ :, a ].todense() ).reshape( -1 ), np.diff( _rows.indptr ) )
+            _joint = np.bincount( _rows.indices[ _after ], weights=np.minimum( _rows.data, _count_a )[ _after ], minlength=len( self.tokens ) ).astype( np.int64 )
+            b_ids = np.flatnonzero( _observed )
+            _scores = PairScores.from_pairs( self.tokens, self.freqs, np.full( len( b_ids ), a ), b_ids, _observed[ b_ids ], self.token_size, self.score_header, _joint[ b_ids ] )
+            rst[ target ] = _scores.report( target, method, cutoff )
+        return rst[ targets ] if isinstance( targets, str ) else rst
+
+    @staticmethod
+    def score_columns( freq_a, freq_b, observed, token_size, joint=None ):
+        """ 쌍 배열에 대한 점수 열 ( observed > 0 인 쌍 )
+            observed 는 a 가 나오는 문서의 b 빈도 합이라 freq_a 보다 클 수 있다. 그래서 정규화된 값은 함께 나온 횟수 joint
+            ( 문서마다 min( a 빈도, b 빈도 ) 의 합. 없으면 min( observed, freq_a, freq_b ) ) 로 구한다 :
+            pmi = log2( joint / expected ), npmi = pmi / -log2( joint / N ) ( -1 ~ 1 로 자름 ), dice = 2 * joint / ( freq_a + freq_b ) ( 0 ~ 1 ),
+            llr = joint 를 ( a, b ) 칸으로 한 Dunning 의 2x2 분할표 log-likelihood ratio ( G² ).
+            t_score, sLLRatio 는 예전처럼 observed 로 구한다 """
+        _xlogx = COQuantifier._xlogx
+        if joint is None:
+            joint = np.minimum( observed, np.minimum( freq_a, freq_b ) )
+        expected = ( freq_a * freq_b ) / token_size
+        t_score = ( observed - expected ) / np.sqrt( observed )
+        _sllr = 2 * ( observed * np.log2( observed / expected ) - ( observed - expected ) )
+        pmi = np.log2( joint / expected )
+        _p = joint / token_size
+        with np.errstate( divide="ignore", invalid="ignore" ):
+            # 부동소수 반올림으로 1 을 조금 넘는 값은 범위 안으로 자른다
+            npmi = np.clip( np.where( _p < 1, pmi / ( -1 * np.log2( _p ) ), 1.0 ), -1.0, 1.0 )
+        # 분할표 : ( a, b ), ( a, not b ), ( not a, b ), ( not a, not b )
+        k11 = joint.astype( np.float64 )
+        k12 = np.maximum( freq_a - k11, 0 )
+        k21 = np.maximum( freq_b - k11, 0 )
+        k22 = np.maximum( token_size - k11 - k12 - k21, 0 )
+        llr = 2 * ( _xlogx( k11 ) + _xlogx( k12 ) + _xlogx( k21 ) + _xlogx( k22 )
+                    - _xlogx( k11 + k12 ) - _xlogx( k21 + k22 ) - _xlogx( k11 + k21 ) - _xlogx( k12 + k22 )
+                    + _xlogx( k11 + k12 + k21 + k22 ) )
+        return {
+            'observed_cooccurrence': observed, 'expected_cooccurrence': expected,
+            't_score': t_score, 'sLLRatio': np.where( observed >= expected, _sllr, -1 * _sllr ),
+            'pmi': pmi, 'npmi': npmi, 'dice': 2 * joint / ( freq_a + freq_b ), 'llr': np.maximum( llr, 0 )
+        }
+
+    def _xlogx( x ):
+        x = np.asarray( x, dtype=np.float64 )
+        return np.where( x > 0, x * np.log( np.maximum( x, 1 ) ), 0 )
+
+    def _doc_counts( doc, token_index, token_sep ):
+        """ 문서 안 token id 의 빈도 ( 처음 나온 순서 ) """
+        _count = Counter()
+        for line in re.split(r"\r?\n", doc):
+            _ids = [ token_index.get( token, -1 ) for token in Corpus.tokenize( line, token_sep ) ]
+            _count.update( [ tid for tid in _ids if tid >= 0 ] )
+        return _count
+
+    def _doc_pairs( _count, size ):
+        """ dict engine 과 같은 쌍 ( 앞 token id * size + 뒤 token id, [ 뒤 token 빈도, min( 두 token 빈도 ) ] ) 배열 """
+        ids = np.fromiter( _count.keys(), dtype=np.int64, count=len( _count ) )
+        counts = np.fromiter( _count.values(), dtype=np.int64, count=len( _count ) )
+        i, j = np.triu_indices( len( ids ), 1 )
+        return ( ids[i] * size + ids[j], np.stack( [ counts[j], np.minimum( counts[i], counts[j] ) ], axis=1 ) )
+
+    def _count_cooccurrence_spill( self, buffer_size=10000000, spill_dir=None ):
+        """ 문서를 하나씩 읽어 쌍을 고정 크기 buffer 에 모으고, 차면 key 로 정렬해 합친 run 을 디스크에 쓴다.
+            run 들은 block 단위 k-way merge 로 합치므로 세는 동안의 memory 는 buffer_size 쌍 정도로 제한된다 """
+        size = len( self.tokens )
+        _dir = tempfile.mkdtemp( prefix="coquantifier_", dir=spill_dir )
+        _keys, _values = np.empty( buffer_size, dtype=np.int64 ), np.empty( ( buffer_size, 2 ), dtype=np.int64 )
+        fill = 0
+        runs = []
+        sys.stdout.flush()
+        print("# Co-occurrence Counting ( spill to {} ) ... ".format( _dir ))
+        try:
+            i = -1
+            for i, doc in enumerate( self._iter_docs() ):
+                keys, values = self.__class__._doc_pairs( self.__class__._doc_counts( doc, self.token_index, self.token_sep ), size )
+                if fill + len( keys ) > buffer_size:
+                    runs.append( self.__class__._spill_run( _keys[:fill], _values[:fill], _dir, len( runs ) ) )
+                    fill = 0
+                if self.doc_size: Tools.print_progress(i+1, self.doc_size, prefix='Progress', suffix='Complete')
+                else: Tools.print_counter(i+1, prefix='Progress', suffix='documents')
+                if len( keys ) > buffer_size:
+                    runs.append( self.__class__._spill_run( keys, values, _dir, len( runs ) ) )
+                    continue
+                _keys[ fill:fill + len( keys ) ], _values[ fill:fill + len( keys ) ] = keys, values
+                fill += len( keys )
+            if not self.doc_size: Tools.print_counter(i+1, prefix='Progress', suffix='documents', done=True)
+            if fill:
+                runs.append( self.__class__._spill_run( _keys[:fill], _values[:fill], _dir, len( runs ) ) )
+            del _keys, _values
+            print("# {} runs were spilled. Merging ... ".format( len( runs ) ))
+            merged = self.__class__._merge_runs( runs, buffer_size, _dir )
+            # 합친 run 은 mmap 으로 block 씩 읽어 CSR 배열에 바로 채운다
+            self._set_pair_counts( [ merged ], buffer_size )
+            del merged
+        finally:
+            shutil.rmtree( _dir, ignore_errors=True )
+        sys.stdout.flush()
+        print("# Co-occurrence Counting was done. System memory {:.3f} Gb used".format( Tools.get_process_memory()) )
+        return self
+
+    def _count_cooccurrence_parallel( self, workers, chunk_size=1000 ):
+        """ 문서를 chunk_size 개씩 process pool 에 나누어 id 쌍으로 세고, 부분 결과를 a id 의 hash( a % workers ) 로 나눈 shard 마다
+            따로 둔 reducer process 에 queue 로 보낸다. reducer 는 _reduce_size 쌍이 모일 때마다 합치고 마지막 결과를 파일로 쓴다.
+            shard 마다 행이 겹치지 않으므로 부모는 파일을 mmap 으로 열어 다시 정렬하지 않고 CSR 에 채운다
+            worker 에는 token_index, token_sep 와 queue 만 보낸다 ( fork 에서는 복사 없이 나누어 쓴다 ). 빈도는 dict engine 과 같다 """
+        _docs = self._iter_docs()
+        _chunks = iter( lambda: list( islice( _docs, chunk_size ) ), [] )
+        _dir = tempfile.mkdtemp( prefix="coquantifier_" )
+        _queues = [ multiprocessing.Queue( 2 * workers ) for i in range( workers ) ]
+        _outputs = [ ( os.path.join( _dir, "shard_{}_keys.bin".format( i ) ), os.path.join( _dir, "shard_{}_values.bin".format( i ) ) ) for i in range( workers ) ]
+        _reducers = [ multiprocessing.Process( target=_reduce_shard, args=( queue, output, self._reduce_size ) ) for queue, output in zip( _queues, _outputs ) ]
+        n_docs = 0
+        sys.stdout.flush()
+        print("# Co-occurrence Counting ( {} workers ) ... ".format( workers ))
+        for reducer in _reducers:
+            reducer.start()
+        _pool = multiprocessing.Pool( workers, initializer=_init_count_worker, initargs=( self.token_index, self.token_sep, len( self.tokens ), _queues ) )
+        try:
+            for n_done in _pool.imap_unordered( _count_chunk, _chunks ):
+                n_docs += n_done
+                Tools.print_counter( n_docs, prefix='Progress', suffix='documents', every=chunk_size )
+            Tools.print_counter( n_docs, prefix='Progress', suffix='documents', done=True )
+            _pool.close(); _pool.join()
+            for queue in _queues:
+                queue.put( None )
+            for reducer in _reducers:
+                reducer.join()
+            if any( reducer.exitcode != 0 for reducer in _reducers ):
+                raise RuntimeError( "A shard reducer failed" )
+            parts = [ ( self.__class__._open_run( k, ( -1, ) ), self.__class__._open_run( v, ( -1, 2 ) ) ) for k, v in _outputs ]
+            self._set_pair_counts( parts, self._reduce_size )
+            del parts
+        finally:
+            _pool.terminate()
+            for reducer in _reducers:
+                if reducer.is_alive(): reducer.terminate()
+            shutil.rmtree( _dir, ignore_errors=True )
+        sys.stdout.flush()
+        print("# Co-occurrence Counting was done. System memory {:.3f} Gb used".format( Tools.get_process_memory()) )
+        return self
+
+    def _count_chunk( docs, token_index, token_sep, size, shards ):
+        """ 문서들의 id 쌍 빈도를 합쳐 a id % shards 별로 나눈다 """
+        _pairs = [ COQuantifier._doc_pairs( COQuantifier._doc_counts( doc, token_index, token_sep ), size ) for doc in docs ]
+        keys, values = COQuantifier._aggregate( np.concatenate( [ np.zeros( 0, dtype=np.int64 ) ] + [ k for k, v in _pairs ] ),
+                                                  np.concatenate( [ np.zeros( ( 0, 2 ), dtype=np.int64 ) ] + [ v for k, v in _pairs ] ) )
+        _shard = ( keys // max( size, 1 ) ) % shards
+        return [ ( keys[ _shard == i ], values[ _shard == i ] ) for i in range( shards ) ]
+
+    def _set_pair_counts( self, parts, block=10000000 ):
+        """ key ( a id * token 수 + b id ) 로 정렬된 ( key 배열, [ 빈도, joint ] 배열 ) 조각들로 CSR 공기 행렬과 PairCounts 를 만든다
+            조각끼리 key 는 겹치지 않는다. mmap 배열도 block 씩 읽어 결과 배열에 바로 채운다 """
+        size = len( self.tokens )
+        _size = max( size, 1 )
+        row_counts = np.zeros( size, dtype=np.int64 )
+        for keys, values in parts:
+            for s in range( 0, len( keys ), block ):
+                row_counts += np.bincount( keys[ s:s + block ] // _size, minlength=size )
+        indptr = np.concatenate( [ [ 0 ], np.cumsum( row_counts ) ] ).astype( np.int64 )
+        indices, observed, joint = np.empty( indptr[-1], dtype=np.int64 ), np.empty( indptr[-1], dtype=np.int64 ), np.empty( indptr[-1], dtype=np.int64 )
+        _next = indptr[:-1].copy()      # 행마다 다음에 채울 자리
+        for keys, values in parts:
+            for s in range( 0, len( keys ), block ):
+                _keys, _values = np.asarray( keys[ s:s + block ] ), np.asarray( values[ s:s + block ] )
+                rows = _keys // _size
+                at = _next[ rows ] + np.arange( len( rows ) ) - np.searchsorted( rows, rows )
+                indices[ at ], observed[ at ], joint[ at ] = _keys % _size, _values[:, 0], _values[:, 1]
+                _next += np.bincount( rows, minlength=size )
+        self.cooccurrence_matrix = sp.csr_matrix( ( observed, indices, indptr ), shape=( size, size ) )
+        self.joint_matrix = sp.csr_matrix( ( joint, indices, indptr ), shape=( size, size ) )
+        self.cooccurrence_matrix.sort_indices()
+        self.joint_matrix.sort_indices()
+        self.cooccurrence = PairCounts( self.cooccurrence_matrix, self.tokens, self.token_index, self.joint_matrix )
+        return self
+
+    def _aggregate( keys, values ):
+        """ 같은 key 의 값( 열마다 )을 합치고 key 순서로 정렬한다 """
+        ukeys, inv = np.unique( keys, return_inverse=True )
+        inv = inv.reshape( -1 )
+        return ( ukeys, np.stack( [ np.bincount( inv, weights=values[:, c], minlength=len( ukeys ) ) for c in range( values.shape[1] ) ], axis=1 ).astype( np.int64 ) )
+
+    def _spill_run( keys, values, path, n ):
+        """ 같은 key 를 합치고 정렬해 run 파일 두 개로 쓴다 """
+        ukeys, uvalues = COQuantifier._aggregate( keys, values )
+        run = ( os.path.join( path, "run_{}_keys.npy".format( n ) ), os.path.join( path, "run_{}_values.npy".format( n ) ) )
+        np.save( run[0], ukeys )
+        np.save( run[1], uvalues )
+        return run
+
+    def _merge_runs( runs, buffer_size, path ):
+        """ 정렬된 run 들을 run 마다 block 만큼씩 읽어 합친다. 모든 block 의 마지막 key 중 가장 작은 key 까지는 빠짐없이 모였으므로 합쳐 내보낸다 """
+        readers = [ ( np.load( k, mmap_mode="r" ), np.load( v, mmap_mode="r" ) ) for k, v in runs ]
+        pos = [ 0 ] * len( readers )
+        block = max( buffer_size // ( len( readers ) + 1 ), 1 )
+        out_keys, out_values = os.path.join( path, "merged_keys.bin" ), os.path.join( path, "merged_values.bin" )
+        with open( out_keys, "wb" ) as fk, open( out_values, "wb" ) as fv:
+            while True:
+                active = [ r for r in range( len( readers ) ) if pos[r] < len( readers[r][0] ) ]
+                if not active: break
+                chunks = { r: ( readers[r][0][ pos[r]:pos[r] + block ], readers[r][1][ pos[r]:pos[r] + block ] ) for r in active }
+                # 끝까지 읽은 run 은 경계를 정하지 않는다
+                _bounds = [ chunks[r][0][-1] for r in active if pos[r] + block < len( readers[r][0] ) ]
+                bound = min( _bounds ) if _bounds else None
+                _k, _v = [], []
+                for r in active:
+                    n = len( chunks[r][0] ) if bound is None else int( np.searchsorted( chunks[r][0], bound, side="right" ) )
+                    _k.append( chunks[r][0][:n] )
+                    _v.append( chunks[r][1][:n] )
+                    pos[r] += n
+                ukeys, uvalues = COQuantifier._aggregate( np.concatenate( _k ), np.concatenate( _v ) )
+                uvalues.tofile( fv )
+                ukeys.astype( np.int64 ).tofile( fk )
+        del readers
+        return ( COQuantifier._open_run( out_keys, ( -1, ) ), COQuantifier._open_run( out_values, ( -1, 2 ) ) )
+
+    def _open_run( path, shape ):
+        """ tofile 로 쓴 int64 파일을 읽기 전용 mmap 으로 연다 ( 빈 파일은 mmap 할 수 없어 빈 배열 ) """
+        width = int( np.prod( shape[1:] ) )
+        n = os.path.getsize( path ) // ( 8 * width )
+        if n == 0:
+            return np.zeros( ( 0, ) + tuple( shape[1:] ), dtype=np.int64 )
+        return np.memmap( path, dtype=np.int64, mode="r", shape=( n, ) + tuple( shape[1:] ) )
+
+    def _build_doc_term( self ):
+        """ 문서 x token id 빈도 CSR 행렬 """
+        _rows, _cols = [], []
+        i = -1
+        for i, doc in enumerate( self._iter_docs() ):
+            for line in re.split(r"\r?\n", doc):
+                _ids = [ self.token_index.get( token, -1 ) for token in Corpus.tokenize( line, self.token_sep ) ]
+                _ids = [ tid for tid in _ids if tid >= 0 ]
+                _rows += [ i ] * len( _ids )
+                _cols += _ids
+            if self.doc_size: Tools.print_progress(i+1, self.doc_size, prefix='Progress', suffix='Complete')
+            else: Tools.print_counter(i+1, prefix='Progress', suffix='documents')
+        if not self.doc_size: Tools.print_counter(i+1, prefix='Progress', suffix='documents', done=True)
+        _shape = ( i + 1, len( self.tokens ) )
+        size = max( len( self.tokens ), 1 )
+        # 출현 순서의 ( 문서, token ) key 에서 처음 나온 자리와 빈도
+        keys, first, counts = np.unique( np.asarray( _rows, dtype=np.int64 ) * size + np.asarray( _cols, dtype=np.int64 ), return_index=True, return_counts=True )
+        rows, cols = keys // size, keys % size
+        indptr = np.searchsorted( rows, np.arange( _shape[0] + 1 ) )
+        # 문서 안에서 처음 나온 순서 ( 1 부터 )
+        order = np.argsort( first, kind="stable" )
+        rank = np.empty( len( keys ), dtype=np.int64 )
+        rank[ order ] = np.arange( len( keys ) ) - indptr[ rows[ order ] ] + 1
+        self.doc_term = sp.csr_matrix( ( counts.astype( np.int64 ), cols, indptr ), shape=_shape )
+        self.first_rank = sp.csr_matrix( ( rank, cols, indptr ), shape=_shape )
+        return self
+
+    def _count_cooccurrence_sparse( self ):
+        """ 문서-단어 빈도 행렬 X ( 문서 x token id ) 의 행마다 처음 나온 순서로 ( 앞 token, 뒤 token, 뒤 token 빈도 ) 쌍 배열을 만들고
+            _pair_batch 쌍씩 희소 행렬로 더한다 ( dict engine 과 같은 빈도 ) """
+        sys.stdout.flush()
+        print("# Co-occurrence Counting ( sparse ) ... ")
+        self._build_doc_term()
+        size = len( self.tokens )
+        rows = np.repeat( np.arange( self.doc_term.shape[0] ), np.diff( self.doc_term.indptr ) )
+        order = np.lexsort( ( self.first_rank.data, rows ) )
+        cols, counts, rank = self.doc_term.indices[ order ], self.doc_term.data[ order ], self.first_rank.data[ order ] - 1
+        # 각 entry 뒤에 같은 문서에서 나중에 나온 token 수
+        n_after = np.diff( self.doc_term.indptr )[ rows ] - 1 - rank
+        ends = np.cumsum( n_after )
+        _matrix, _joint = sp.csr_matrix( ( size, size ), dtype=np.int64 ), sp.csr_matrix( ( size, size ), dtype=np.int64 )
+        start = 0
+        while start < len( cols ):
+            end = max( int( np.searchsorted( ends, ends[ start ] - n_after[ start ] + self._pair_batch, side="right" ) ), start + 1 )
+            _n = n_after[ start:end ]
+            a_idx = np.repeat( np.arange( start, end ), _n )
+            b_idx = a_idx + 1 + np.arange( len( a_idx ) ) - np.repeat( np.cumsum( _n ) - _n, _n )
+            _matrix = _matrix + sp.csr_matrix( ( counts[ b_idx ], ( cols[ a_idx ], cols[ b_idx ] ) ), shape=( size, size ), dtype=np.int64 )
+            _joint = _joint + sp.csr_matrix( ( np.minimum( counts[ a_idx ], counts[ b_idx ] ), ( cols[ a_idx ], cols[ b_idx ] ) ), shape=( size, size ), dtype=np.int64 )
+            start = end
+        for m in ( _matrix, _joint ):
+            m.eliminate_zeros()
+            m.sort_indices()
+        self.cooccurrence_matrix, self.joint_matrix = _matrix.tocsr(), _joint.tocsr()
+        self.cooccurrence = PairCounts( self.cooccurrence_matrix, self.tokens, self.token_index, self.joint_matrix )
         sys.stdout.flush()
         print("# Co-occurrence Counting was done. System memory {:.3f} Gb used".format( Tools.get_process_memory()) )
         return self
 
     def score( self ):
-        # t-score
-        _scores = defaultdict( lambda: 0)
-        # template
-        _tpl = namedtuple("Scores", self.score_header ) # ['total_freq', 'observed_cooccurrence', 'expected_cooccurrence', 't_score']
-        total_len = len( self.cooccurrence )
+        """ 모든 쌍의 점수를 쌍 배열에 대한 numpy 연산으로 한 번에 구해 a 별로 모은 열 배열( PairScores )에 둔다 """
         print("# Co-occurrence Scores Generating ... ")
-        i = 0
-        for a, b in self.cooccurrence:
-            _freq_a, _freq_b = self.token_freq[a], self.token_freq[b]
-            _observed = self.cooccurrence[ (a,b) ]
-            _expected = ( _freq_a * _freq_b ) / self.token_size
-            _t_score = self.__class__.get_Tscore( _observed, _expected )
-            _sllr = self.__class__.get_SimpleLogLikelihoodRatio( _observed, _expected )
-            _scores[ (a,b) ] = _tpl( ( _freq_a, _freq_b ),  _observed, _expected,  _t_score, _sllr )
-            Tools.print_progress(i+1, total_len, prefix='Progress', suffix='Complete')
-            i += 1
-        self._scores = _scores
+        if isinstance( self.cooccurrence, PairCounts ):
+            a_ids, b_ids, observed, joint = self.cooccurrence.pair_ids()
+        else:
+            _pairs = [ ( pair, n ) for pair, n in self.cooccurrence.items() if n > 0 ]
+            a_ids = np.asarray( [ self.token_index[ a ] for ( a, b ), n in _pairs ], dtype=np.int64 )
+            b_ids = np.asarray( [ self.token_index[ b ] for ( a, b ), n in _pairs ], dtype=np.int64 )
+            observed = np.asarray( [ n for pair, n in _pairs ], dtype=np.int64 )
+            joint = np.asarray( [ self.joint_cooccurrence[ pair ] for pair, n in _pairs ], dtype=np.int64 ) if hasattr( self, "joint_cooccurrence" ) else None
+        self._scores = PairScores.from_pairs( self.tokens, self.freqs, a_ids, b_ids, observed, self.token_size, self.score_header, joint )
         sys.stdout.flush()
         print("# Co-occurrence Scores were generated. System memory {:.3f} Gb used".format( Tools.get_process_memory() ) )
         return self
@@ -84,17 +439,58 @@ class COQuantifier:  # co-occurrence
         stream.write( "\t".join( [ "tokens" ] + self.score_header ) + "\n" )
         _rst = self.report( target_token, method, cutoff )
         for token, score in _rst:
-            _tmp = list( score )
-            _freq = [ str( _tmp[0][1] ), str( _tmp[1] ) ]
-            _etc = list( map( lambda x: "{:.3f}".format(x), _tmp[2:] ) )
-            stream.write( "\t".join(  [ token ] + _freq + _etc )  + "\n" )
+            stream.write( self.__class__._format_row( token, score ) )
+        stream.close()
         print("# Report File was exported ")
 
+    def export_all( self, file_name, method="t_score", k=None, cutoff=None, targets=None ):
+        """ 모든 token ( 또는 targets ) 의 공기어를 한 파일에 target 순서대로 이어 쓴다 ( k 를 주면 target 마다 상위 k 개 ) """
+        stream = open(file_name, 'w', encoding="utf-8")
+        stream.write( "\t".join( [ "target", "tokens" ] + self.score_header ) + "\n" )
+        n_rows = 0
+        for target in ( self._scores.tokens if targets is None else targets ):
+            for token, score in self._scores.top_k( target, k, method, cutoff ):
+                stream.write( target + "\t" + self.__class__._format_row( token, score ) )
+                n_rows += 1
+        stream.close()
+        print("# {:d} pairs were exported in {}".format( n_rows, file_name ))
+        return self
+
+    def _format_row( token, score ):
+        _tmp = list( score )
+        _freq = [ str( _tmp[0][1] ), str( _tmp[1] ) ]
+        _etc = list( map( lambda x: "{:.3f}".format(x), _tmp[2:] ) )
+        return "\t".join(  [ token ] + _freq + _etc )  + "\n"
+
+    def top_k( self, k=10, method="t_score", targets=None, cutoff=None ):
+        """ targets ( 없으면 공기어가 있는 모든 token ) 마다 method 점수가 가장 큰 공기어 k 개 { target : [ ( token, score ), ... ] }
+            행마다 argpartition 으로 k 개만 골라 정렬한다 """
+        if targets is None:
+            targets = [ str( self._scores.tokens[a] ) for a in np.flatnonzero( np.diff( self._scores.indptr ) ) ]
+        return { target: self._scores.top_k( target, k, method, cutoff ) for target in targets }
+
 
     def report( self, target_token, method="t_score", cutoff=1.5 ):
-        _rst = [ ( b, self._scores[(a,b)] ) for (a, b) in self._scores if a == target_token ]
-        _rst_gt = [ (b, sc) for b, sc in _rst if getattr(sc, method) >= cutoff ]
-        return sorted( _rst_gt, key=lambda x: getattr(x[1], method), reverse=True )
+        return self._scores.report( target_token, method, cutoff )
+
+    def save( self, path ):
+        """ score() 한 결과( 어휘, 빈도, 쌍 점수 )를 path 폴더에 .npy 파일로 저장한다 """
+        self._scores.save( os.path.join( path, "scores" ) )
+        Tools.save_arrays( path, {}, { "engine": getattr( self, "engine", None ), "token_size": int( self.token_size ) } )
+        print("# Co-occurrence Model was saved in {}".format( path ))
+        return self
+
+    @classmethod
+    def load_model( cls, path, mmap_mode="r" ):
+        """ save() 한 모델을 다시 세지 않고 읽는다. 배열은 mmap 으로 열어 여러 process 가 한 벌을 나누어 쓴다 ( report, top_k, export 용 )
+            어휘는 mmap 한 정렬 token 배열에서 이진 탐색으로 찾으므로 읽는 데 어휘 크기만큼의 list 나 dict 를 만들지 않는다 """
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        model = cls()
+        model.engine, model.token_size = meta["engine"], meta["token_size"]
+        model._scores = PairScores.load( os.path.join( path, "scores" ), mmap_mode )
+        model.score_header = model._scores.header
+        model.tokens, model.freqs = model._scores.tokens, model._scores.freqs
+        return model
 
     @staticmethod
     def get_Tscore( observed , expected ):
@@ -110,6 +506,135 @@ class COQuantifier:  # co-occurrence
 
 
 
+class PairCounts( Mapping ):
+    """ 공기 빈도 CSR 행렬( 행 a, 열 b 는 token id )을 ( a, b ) -> 빈도 dict 처럼 읽는 view. 없는 쌍은 0 """
+
+    def __init__( self, matrix, tokens, token_index, joint=None ):
+        self.matrix = matrix
+        self.tokens = tokens
+        self.token_index = token_index
+        self.joint = joint          # matrix 와 같은 모양의 joint 행렬 ( 문서마다 min( a 빈도, b 빈도 ) 의 합 )
+
+    def __getitem__( self, pair ):
+        a, b = self.token_index.get( pair[0], -1 ), self.token_index.get( pair[1], -1 )
+        if a < 0 or b < 0:
+            return 0
+        start, end = self.matrix.indptr[a], self.matrix.indptr[a+1]
+        at = start + np.searchsorted( self.matrix.indices[start:end], b )
+        return int( self.matrix.data[at] ) if at < end and self.matrix.indices[at] == b else 0
+
+    def __contains__( self, pair ):
+        return self[ pair ] > 0
+
+    def pair_ids( self ):
+        """ 0 이 아닌 쌍의 ( a id 배열, b id 배열, 빈도 배열, joint 배열 또는 None ) """
+        rows = np.repeat( np.arange( self.matrix.shape[0] ), np.diff( self.matrix.indptr ) )
+        return ( rows, self.matrix.indices, self.matrix.data, None if self.joint is None else self.joint.data )
+
+    def __iter__( self ):
+        rows, cols, counts, joint = self.pair_ids()
+        for a, b in zip( rows.tolist(), cols.tolist() ):
+            yield ( self.tokens[a], self.tokens[b] )
+
+    def __len__( self ):
+        return self.matrix.nnz
+
+
+class PairScores( Mapping ):
+    """ ( a, b ) 쌍의 점수를 a 별로 모은 CSR 모양의 열 배열
+    indptr[a] ~ indptr[a+1] 구간에 a 의 공기어 id( neighbors )와 점수 열( columns )이 b id 순서로 있다.
+    ( a, b ) -> namedtuple 로 읽을 수 있고 없는 쌍은 0.
+    load() 한 표는 token 을 dict 대신 정렬된 token 배열( sorted_tokens, sorted_ids )에서 이진 탐색으로 찾는다 """
+
+    def __init__( self, tokens, freqs, indptr, neighbors, columns, header, sorted_tokens=None, sorted_ids=None ):
+        self.tokens = tokens
+        self.token_index = { token: i for i, token in enumerate( tokens ) } if sorted_tokens is None else None
+        self.sorted_tokens, self.sorted_ids = sorted_tokens, sorted_ids
+        self.freqs = freqs
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.columns = columns
+        self.header = list( header )
+        self._tpl = namedtuple( "Scores", self.header )
+
+    @classmethod
+    def from_pairs( cls, tokens, freqs, a_ids, b_ids, observed, token_size, header, joint=None ):
+        order = np.lexsort( ( b_ids, a_ids ) )
+        a_ids, b_ids, observed = a_ids[ order ], b_ids[ order ], observed[ order ]
+        indptr = np.concatenate( [ [ 0 ], np.cumsum( np.bincount( a_ids, minlength=len( tokens ) ) ) ] ).astype( np.int64 )
+        columns = COQuantifier.score_columns( freqs[ a_ids ], freqs[ b_ids ], observed, token_size, None if joint is None else joint[ order ] )
+        return cls( tokens, freqs, indptr, b_ids, columns, header )
+
+    def save( self, path ):
+        """ indptr, neighbors, 점수 열을 path 폴더에 .npy 파일로 저장한다 """
+        arrays = { "column_{}".format( h ): self.columns[h] for h in self.columns }
+        tokens = np.asarray( list( self.tokens ), dtype=np.str_ )
+        order = np.argsort( tokens, kind="stable" )
+        arrays.update( { "tokens": tokens, "sorted_tokens": tokens[ order ], "sorted_ids": order.astype( np.int64 ),
+                         "freqs": self.freqs, "indptr": self.indptr, "neighbors": self.neighbors } )
+        Tools.save_arrays( path, arrays, { "header": self.header, "columns": list( self.columns ) } )
+        return self
+
+    @classmethod
+    def load( cls, path, mmap_mode="r" ):
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        columns = { h: arrays[ "column_{}".format( h ) ] for h in meta["columns"] }
+        return cls( arrays["tokens"], arrays["freqs"], arrays["indptr"], arrays["neighbors"], columns, meta["header"], arrays["sorted_tokens"], arrays["sorted_ids"] )
+
+    def _id( self, token ):
+        """ token id ( 없으면 -1 ) """
+        if self.token_index is not None:
+            return self.token_index.get( token, -1 )
+        if not isinstance( token, str ) or len( self.sorted_tokens ) == 0:
+            return -1
+        at = int( np.searchsorted( self.sorted_tokens, token ) )
+        return int( self.sorted_ids[ at ] ) if at < len( self.sorted_tokens ) and self.sorted_tokens[ at ] == token else -1
+
+    def _score( self, a, k ):
+        b = self.neighbors[k]
+        return self._tpl( ( int( self.freqs[a] ), int( self.freqs[b] ) ), *[ self.columns[h][k].item() for h in self.header[1:] ] )
+
+    def _find( self, pair ):
+        a, b = self._id( pair[0] ), self._id( pair[1] )
+        if a < 0 or b < 0:
+            return ( a, -1 )
+        start, end = self.indptr[a], self.indptr[a+1]
+        k = start + np.searchsorted( self.neighbors[start:end], b )
+        return ( a, k if k < end and self.neighbors[k] == b else -1 )
+
+    def report( self, target_token, method="t_score", cutoff=1.5 ):
+        """ target 의 공기어를 method 점수 순서로 ( cutoff 이상만 ) """
+        return self.top_k( target_token, None, method, cutoff )
+
+    def top_k( self, target_token, k=None, method="t_score", cutoff=None ):
+        """ target 행에서 method 점수가 큰 공기어 k 개 ( argpartition 으로 k 개를 고른 뒤 그것만 정렬 ) """
+        a = self._id( target_token )
+        if a < 0:
+            return []
+        start, end = self.indptr[a], self.indptr[a+1]
+        _values = self.columns[ method ][start:end]
+        _keep = np.arange( end - start ) if cutoff is None else np.flatnonzero( _values >= cutoff )
+        if k is not None and len( _keep ) > k:
+            _keep = np.sort( _keep[ np.argpartition( -1 * _values[ _keep ], k - 1 )[:k] ] )
+        _keep = _keep[ np.argsort( -1 * _values[ _keep ], kind="stable" ) ]
+        return [ ( str( self.tokens[ self.neighbors[ start + i ] ] ), self._score( a, start + i ) ) for i in _keep ]
+
+    def __getitem__( self, pair ):
+        a, k = self._find( pair )
+        return self._score( a, k ) if k >= 0 else 0
+
+    def __contains__( self, pair ):
+        return self._find( pair )[1] >= 0
+
+    def __iter__( self ):
+        rows = np.repeat( np.arange( len( self.indptr ) - 1 ), np.diff( self.indptr ) )
+        for a, b in zip( rows.tolist(), self.neighbors.tolist() ):
+            yield ( str( self.tokens[a] ), str( self.tokens[b] ) )
+
+    def __len__( self ):
+        return len( self.neighbors )
+
+
 class COQuantifierDocs(COQuantifier):
     def __init__(self):
         pass
@@ -119,53 +644,158 @@ class COQuantifierPairs(COQuantifier):
         pass
 
 class COQuantifierWindow(COQuantifier):
-    def __init__(self, half_window=10):
+    """ target 의 앞뒤 half_window 글자 안에 나오는 token 을 공기어로 센다
+    분절하지 않은 text 를 한 번 나누어 token 출현 위치 표를 만들고, target 들의 출현은 Trie 로 한 번에 찾는다
+    segmenter 를 주지 않으면 공백이 없는 gram_size 글자 gram 을 numpy 로 바로 만든다 """
+
+    _blank = " \t\r\n\f\v\u3000"    # gram 에 들어가면 버리는 글자
+
+    def __init__(self, half_window=10, segmenter=None, gram_size=2):
         self.half_window = half_window
+        self.segmenter = segmenter
+        self.gram_size = gram_size
 
     def load( self, text_unsegmented, doc_sep="(\r?\n){2,}" ):
-        self.text = text_unsegmented
+        self.text = text_unsegmented.to_string() if isinstance( text_unsegmented, Corpus ) else text_unsegmented
         self.doc_sep = doc_sep
-        self.line_end = line_end
+        self.token_size = len( self.text )
+        self.starts = None
         return self
 
-    def subtext( self, target_token ):
-        self.target_token = target_token
-        win_size = ( self.half_window * 2 )
-        segs = re.split( re.compile(target_token), self.text )
-        segs_size = len(segs)
-        subtxt = []
-        for i, seg in enumerate( segs ):
-            if i == 0:
-                if len(seg) < self.half_window: subtxt.append( seg )
-                else: subtxt.append( seg[(-1 * self.half_window):] )
-                continue
-            if i == ( segs_size - 1 ):
-                if len(seg) < self.half_window: subtxt.append( seg )
-                else: subtxt.append( seg[:self.half_window] )
-                continue
-            if len(seg) <= win_size: subtxt.append( seg )
-            else: subtxt.append( seg[:self.half_window] ); subtxt.append( seg[(-1 * self.half_window):] )
+    def index( self ):
+        """ token 출현 위치 표 ( 시작 순서의 시작, 끝, token id ) 와 token 빈도 """
+        if self.segmenter is None:
+            spans, self.tokens = self._gram_spans()
+        else:
+            spans = self.segmenter.load( self.text ).segment().to_spans( as_numpy=True ).astype( np.int64 )
+            self.tokens = list( self.segmenter.vocabulary() )
+        spans = spans[ np.argsort( spans[:, 0], kind="stable" ) ]
+        self.starts, self.ends, self.token_ids = spans[:, 0], spans[:, 1], spans[:, 2]
+        self.token_index = { token: i for i, token in enumerate( self.tokens ) }
+        self.freqs = np.bincount( self.token_ids, minlength=len( self.tokens ) ).astype( np.int64 )
+        print("# Positions of {} tokens were indexed".format( len( self.tokens ) ))
+        return self
 
-        self._subtext = [ txt for txt in subtxt if len(txt) > 0 ]
+    def _gram_spans( self ):
+        """ 글자 code 배열에서 공백이 없는 gram 의 ( 시작, 끝, token id ) 배열과 token id -> gram. token id 는 gram 의 code 순서 """
+        g = self.gram_size
+        codes = np.frombuffer( self.text.encode( "utf-32-le" ), dtype=np.uint32 ).astype( np.int64 )
+        n = max( len( codes ) - g + 1, 0 )
+        _blank = np.concatenate( [ [ 0 ], np.cumsum( np.isin( codes, [ ord( c ) for c in self._blank ] ) ) ] )
+        starts = np.flatnonzero( _blank[ g:g + n ] - _blank[ :n ] == 0 )
+        grams = np.stack( [ codes[ starts + k ] for k in range( g ) ], axis=1 )
+        if g * 21 <= 63:
+            # code point 는 21 bit 안이므로 gram 을 정수 하나로 묶어 unique 한다
+            keys = np.zeros( len( starts ), dtype=np.int64 )
+            for k in range( g ):
+                keys = ( keys << 21 ) | grams[:, k]
+            _, first, token_ids = np.unique( keys, return_index=True, return_inverse=True )
+        else:
+            _, first, token_ids = np.unique( grams, axis=0, return_index=True, return_inverse=True )
+        tokens = [ self.text[ b:b + g ] for b in starts[ first ].tolist() ]
+        return np.stack( [ starts, starts + g, token_ids.reshape( -1 ) ], axis=1 ), tokens
+
+    def _windows( self, occurs ):
+        """ 출현 ( 시작, 끝 ) 배열의 앞뒤 half_window 구간을 합치고 target 자리를 뺀 구간들 ( 시작, 끝 ) """
+        b, e = occurs[:, 0], occurs[:, 1]
+        win_b = np.concatenate( [ np.maximum( b - self.half_window, 0 ), e ] )
+        win_e = np.concatenate( [ b, np.minimum( e + self.half_window, self.token_size ) ] )
+        points = np.unique( np.concatenate( [ win_b, win_e, b, e ] ) )
+        left, right = points[:-1], points[1:]
+        # 각 기본 구간의 왼쪽 끝을 덮는 window 수와 target 수
+        _covered = np.searchsorted( np.sort( win_b ), left, side="right" ) - np.searchsorted( np.sort( win_e ), left, side="right" )
+        _blocked = np.searchsorted( np.sort( b ), left, side="right" ) - np.searchsorted( np.sort( e ), left, side="right" )
+        good = ( _covered > 0 ) & ( _blocked == 0 )
+        left, right = left[ good ], right[ good ]
+        # 이어진 구간은 하나로 합친다
+        _new = np.concatenate( [ [ True ], left[1:] != right[:-1] ] ) if len( left ) else np.zeros( 0, dtype=bool )
+        _group = np.cumsum( _new ) - 1
+        run_b = left[ _new ]
+        run_e = np.zeros( len( run_b ), dtype=np.int64 )
+        np.maximum.at( run_e, _group, right )
+        return np.stack( [ run_b, run_e ], axis=1 )
 
-    def score( self, segmenter=SegmenterGram(), keyword_only=False ):
-        subtext_count = Counter( segmenter.load( " ".join( self._subtext ) ).segment().to_list(keyword_only=keyword_only) )
-        _scores = defaultdict( lambda: 0)
-        # template
-        _tpl = namedtuple("Scores", self.score_header ) # ['total_freq', 'observed_cooccurrence', 'expected_cooccurrence', 't_score']
+    def subtext( self, target_token ):
+        """ target 의 앞뒤 window 문자열들 """
+        occurs = np.asarray( [ ( b, e ) for b, e, tid in Trie( [ target_token ] ).find_all( self.text ) ], dtype=np.int64 ).reshape( -1, 2 )
+        self._subtext = [ self.text[ b:e ] for b, e in self._windows( occurs ).tolist() ]
+        return self._subtext
 
+    def score( self, targets ):
+        """ targets ( 하나 또는 여럿 ) 의 window 안에 완전히 들어오는 token 출현을 세어 점수를 구한다
+            target 의 빈도는 text 안의 출현 수, 공기어의 빈도는 segmenter 로 나눈 전체 token 빈도 ( str.count 를 다시 하지 않는다 ) """
+        if self.starts is None:
+            self.index()
+        _targets = [ targets ] if isinstance( targets, str ) else list( targets )
+        _trie = Trie( _targets )
+        _occurs = defaultdict( list )
+        for b, e, tid in _trie.find_all( self.text ):
+            _occurs[ _trie.tokens[ tid ] ].append( ( b, e ) )
+        for target in _targets:
+            if target not in self.token_index:
+                self.token_index[ target ] = len( self.tokens )
+                self.tokens.append( target )
+        freqs = np.concatenate( [ self.freqs, np.zeros( len( self.tokens ) - len( self.freqs ), dtype=np.int64 ) ] )
+        a_ids, b_ids, observed, joint = [], [], [], []
         print("# Co-occurrence Scores Generating ... ")
-        i = 0
-        for tk, fq in subtext_count.items():
-            _freq_a, _freq_b = self.text.count( self.target_token ), self.text.count( tk )
-            _observed = fq
-            _expected = ( _freq_a * _freq_b ) len() / len( self.text )
-            _t_score = self.__class__.get_Tscore( _observed, _expected )
-            _sllr = self.__class__.get_SimpleLogLikelihoodRatio( _observed, _expected )
-            _scores[ (a,b) ] = _tpl( ( _freq_a, _freq_b ),  _observed, _expected,  _t_score, _sllr )
-            Tools.print_progress(i+1, total_len, prefix='Progress', suffix='Complete')
-            i += 1
+        for target in _targets:
+            a = self.token_index[ target ]
+            occurs = np.asarray( _occurs[ target ], dtype=np.int64 ).reshape( -1, 2 )
+            freqs[a] = len( occurs )
+            runs = self._windows( occurs )
+            # 구간 안에서 시작하는 출현만 위치 표에서 잘라 끝이 구간 안인 것을 센다
+            lo, hi = np.searchsorted( self.starts, runs[:, 0] ), np.searchsorted( self.starts, runs[:, 1] )
+            _lens = hi - lo
+            _idx = np.repeat( lo - ( np.cumsum( _lens ) - _lens ), _lens ) + np.arange( _lens.sum() )
+            _inside = self.ends[ _idx ] <= np.repeat( runs[:, 1], hi - lo )
+            _count = np.bincount( self.token_ids[ _idx[ _inside ] ], minlength=len( self.tokens ) )
+            _count[a] = 0
+            # 이어진 구간마다 min( 구간에 window 가 걸친 target 출현 수, b 출현 수 ) 를 더한 joint
+            _run_of = np.repeat( np.arange( len( runs ) ), _lens )[ _inside ]
+            _n_target = np.zeros( len( runs ), dtype=np.int64 )
+            for win_b, win_e in ( ( np.maximum( occurs[:, 0] - self.half_window, 0 ), occurs[:, 0] ), ( occurs[:, 1], np.minimum( occurs[:, 1] + self.half_window, self.token_size ) ) ):
+                win_b, win_e = win_b[ win_b < win_e ], win_e[ win_b < win_e ]
+                _n_target += np.searchsorted( np.sort( win_b ), runs[:, 1] ) - np.searchsorted( np.sort( win_e ), runs[:, 0], side="right" )
+            _keys, _n_b = np.unique( _run_of * len( self.tokens ) + self.token_ids[ _idx[ _inside ] ], return_counts=True )
+            _joint = np.bincount( _keys % len( self.tokens ), weights=np.minimum( _n_b, _n_target[ _keys // len( self.tokens ) ] ), minlength=len( self.tokens ) )
+            _b = np.flatnonzero( _count )
+            a_ids.append( np.full( len( _b ), a ) )
+            b_ids.append( _b )
+            observed.append( _count[ _b ] )
+            joint.append( _joint[ _b ] )
+        _concat = lambda arrays: np.concatenate( arrays ).astype( np.int64 ) if arrays else np.zeros( 0, dtype=np.int64 )
+        self._scores = PairScores.from_pairs( self.tokens, freqs, _concat( a_ids ), _concat( b_ids ), _concat( observed ), self.token_size, self.score_header, _concat( joint ) )
         sys.stdout.flush()
         print("# Co-occurrence Scores were generated. System memory {:.3f} Gb used".format( Tools.get_process_memory() ) )
-        self._scores[self.target_token] = _scores
         return self
+
+
+# process pool 이 세는 데 쓰는 ( token_index, token_sep, token 수 ) 와 shard reducer queue ( fork 에서는 부모 process 의 것을 그대로 나누어 쓴다 )
+_count_state = None
+_queues = None
+
+def _init_count_worker( token_index, token_sep, size, queues ):
+    global _count_state, _queues
+    _count_state, _queues = ( token_index, token_sep, size ), queues
+
+def _count_chunk( docs ):
+    for queue, part in zip( _queues, COQuantifier._count_chunk( docs, *_count_state, len( _queues ) ) ):
+        if len( part[0] ): queue.put( part )
+    return len( docs )
+
+def _reduce_shard( queue, output, reduce_size ):
+    """ 한 shard 의 부분 결과를 queue 에서 받아 reduce_size 쌍이 모일 때마다 합치고, 끝나면 ( keys, values ) 파일로 쓴다 """
+    keys, values = np.zeros( 0, dtype=np.int64 ), np.zeros( ( 0, 2 ), dtype=np.int64 )
+    pending, n_pending = [], 0
+    while True:
+        part = queue.get()
+        if part is not None:
+            pending.append( part )
+            n_pending += len( part[0] )
+        if pending and ( part is None or n_pending >= reduce_size ):
+            keys, values = COQuantifier._aggregate( np.concatenate( [ keys ] + [ k for k, v in pending ] ), np.concatenate( [ values ] + [ v for k, v in pending ] ) )
+            pending, n_pending = [], 0
+        if part is None:
+            break
+    keys.tofile( output[0] )
+    values.tofile( output[1] )
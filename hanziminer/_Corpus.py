@@ -1,6 +1,8 @@
 # -*- encoding:utf8 -*-
 
+import os
 import re
+import inspect
 import yaml
 import pkg_resources
 from hanziminer import Tools
@@ -8,12 +10,44 @@ from hanziminer import Tools
 
 class Corpus:
 
+    default_dicts = ['dicts/duplications.dic', 'dicts/variants.dic']
+    default_steps = ['merge_duplications', 'merge_variants', 'remove_comments', 'remove_punctuation', 'remove_chrs', 'merge_spaces']
+    _chr_maps = {}  # 사전 경로 tuple 별로 compile 된 치환 table ( process 당 1회 load )
+    _sep_overlap = 1024     # 길이 제한이 없는 doc_sep 에서 chunk 경계 앞을 다시 훑는 글자 수
+
     def __init__( self, text, doc_sep="(\r?\n){2,}" ):
         self._text = text
         self.doc_sep = doc_sep
         self._docs = []
+        self._sources = None    # streaming mode 에서 읽을 file 목록
+        self._steps = []        # streaming mode 에서 문서마다 적용할 정제 단계
+
+    @classmethod
+    def from_file( cls, file_name, doc_sep="(\r?\n){2,}", chunk_size=1048576, encoding="utf-8" ):
+        return cls.from_files( [ file_name ], doc_sep, chunk_size, encoding )
+
+    @classmethod
+    def from_files( cls, file_names, doc_sep="(\r?\n){2,}", chunk_size=1048576, encoding="utf-8" ):
+        """ 전체 text 를 memory 에 올리지 않는 streaming Corpus
+        file 들을 chunk_size 글자씩 읽어 doc_sep 로 문서를 나누고, 정제 method 들은 문서마다 적용한다 """
+        corpus = cls( None, doc_sep )
+        corpus._sources = list( file_names )
+        corpus.chunk_size = chunk_size
+        corpus.encoding = encoding
+        return corpus
+
+    @property
+    def streaming( self ):
+        return self._sources is not None
+
+    def _add_step( self, name, **kwargs ):
+        self._steps.append( ( name, kwargs ) )
+        print("# {} will be applied to each document".format( name ) )
+        return self
 
     def remove_comments( self, comments_header="#" ):
+        if self.streaming:
+            return self._add_step( "remove_comments", comments_header=comments_header )
         _comments_pattern = "{}.*?$".format( comments_header )
         self.comments_pattern = re.compile( _comments_pattern, re.MULTILINE|re.DOTALL )
         self._text = re.sub( self.comments_pattern, " ", self._text ).strip()
@@ -21,12 +55,16 @@ class Corpus:
         return self
 
     def remove_punctuation( self, punctuations="[,\.\!！\?？\:;＇，ㆍ．／：；｀、。·‥…¨〃∼´～˝\%\-\\\(\)\{\}\[\]\<\>（）［］｛｝‘’“”〔〕〈〉《》「」『』【】%\$]" ):
+        if self.streaming:
+            return self._add_step( "remove_punctuation", punctuations=punctuations )
         self.punctuations_pattern = re.compile( punctuations )
         self._text = re.sub( self.punctuations_pattern , " ", self._text ).strip()
         print("# Punctuations were removed")
         return self
 
     def remove_chrs( self, chr_types=["Korean", "Alphabet", "Numbers"] ):
+        if self.streaming:
+            return self._add_step( "remove_chrs", chr_types=chr_types )
         if "Korean" in chr_types:
             self._text = re.sub( re.compile("[가-힣]+"), " ", self._text )
         if "Alphabet" in chr_types:
@@ -38,29 +76,121 @@ class Corpus:
         return self
 
     def merge_spaces( self ):
+        if self.streaming:
+            return self._add_step( "merge_spaces" )
         self._text = re.sub( re.compile("[ \t]+"), " ", self._text )
         self._text = re.sub( re.compile("^[ \t]+", re.MULTILINE), "", self._text ).strip()
         print("# Spaces were merged")
         return self
 
     def merge_duplications(self, dict_path='dicts/duplications.dic') :
-        _dict_path = pkg_resources.resource_filename( __name__ , dict_path)
-        self._text = self.__class__.merge_chrs( self._text, _dict_path )
+        if self.streaming:
+            return self._add_step( "merge_duplications", dict_path=dict_path )
+        self._text = self.__class__.merge_chrs( self._text, dict_path )
         print("# Duplicated Characters were merged")
         return self
 
     def merge_variants(self, dict_path='dicts/variants.dic' ):
-        _dict_path = pkg_resources.resource_filename( __name__ , dict_path)
-        self._text = self.__class__.merge_chrs( self._text, _dict_path )
+        if self.streaming:
+            return self._add_step( "merge_variants", dict_path=dict_path )
+        self._text = self.__class__.merge_chrs( self._text, dict_path )
         print("# Variants Characters were merged")
         return self
 
+    def normalize( self, dict_paths=None, user_dict_paths=[] ):
+        """ 기본 사전( duplications, variants )과 사용자 사전을 하나의 table 로 묶어 한 번에 치환 """
+        if self.streaming:
+            return self._add_step( "normalize", dict_paths=dict_paths, user_dict_paths=user_dict_paths )
+        _dict_paths = list( self.default_dicts if dict_paths is None else dict_paths ) + list( user_dict_paths )
+        self._text = self.__class__.merge_chrs( self._text, _dict_paths )
+        print("# Characters were normalized")
+        return self
+
+    def clean( self, steps=None ):
+        """ 정제 단계들을 미리 선언해 두고 한 번에 적용. steps 는 method 이름 또는 ( 이름, kwargs ) 의 list
+        e.g. [ "merge_variants", ( "remove_comments", { "comments_header": "//" } ), "remove_punctuation", "merge_spaces" ] """
+        self.cleaner = Cleaner( self.default_steps if steps is None else steps )
+        if self.streaming:
+            self._steps += self.cleaner.steps
+            print("# Cleaning steps ({}) will be applied to each document".format( ", ".join( self.cleaner.step_names ) ) )
+            return self
+        self._text = self.cleaner( self._text )
+        print("# Cleaning steps ({}) were applied".format( ", ".join( self.cleaner.step_names ) ) )
+        return self
+
     def _text2docs( self ):
         docs = re.split( re.compile( self.doc_sep ), self._text )
         self._docs = [ doc.strip().split() for doc in docs ]
         return self
 
+    def iter_texts( self ):
+        """ 정제된 문서를 문자열로 하나씩 생성 ( 빈 문서는 건너뜀 ) """
+        pattern = re.compile( self.doc_sep )
+        if not self.streaming:
+            for doc in self.__class__._split_docs( self._text, pattern ):
+                if doc: yield doc
+            return
+        cleaner = Cleaner( self._steps ) if self._steps else None
+        for raw_doc in self._iter_raw_docs( pattern ):
+            if cleaner is None:
+                if raw_doc: yield raw_doc
+                continue
+            # 정제 과정에서 새로 생긴 문서 경계( 주석만 있던 줄 등 )도 전체 text 를 정제한 뒤 나눈 것과 같게 다시 나눈다
+            for doc in self.__class__._split_docs( cleaner( raw_doc ), pattern ):
+                if doc: yield doc
+
+    def iter_docs( self ):
+        """ 문서를 token list 로 하나씩 생성 """
+        for doc in self.iter_texts():
+            yield doc.split()
+
+    def _iter_raw_docs( self, pattern ):
+        """ 이미 훑은 문서 앞부분은 pieces 에 모아 두고, chunk 마다 앞 buffer 의 끝 overlap 글자와 새 chunk 만 다시 훑는다 ( 문서 길이에 비례 ).
+            buffer 끝에서 끝나는 구분자는 다음 chunk 에서 더 길어질 수 있으므로 파일 끝이 아니면 받지 않고 다시 훑는다 """
+        overlap = self.__class__._sep_width( pattern )
+        for file_name in self._sources:
+            with open( file_name, 'r', encoding=self.encoding ) as stream:
+                pieces, buffer = [], ""
+                while True:
+                    chunk = stream.read( self.chunk_size )
+                    eof = not chunk
+                    buffer += chunk
+                    start, keep = 0, None
+                    for m in pattern.finditer( buffer ):
+                        if m.end() == m.start(): continue
+                        if m.end() == len( buffer ) and not eof:
+                            keep = m.start()
+                            break
+                        yield ( "".join( pieces ) + buffer[start:m.start()] ).strip()
+                        pieces, start = [], m.end()
+                    if eof:
+                        yield ( "".join( pieces ) + buffer[start:] ).strip()
+                        break
+                    # 구분자가 시작될 수 있는 끝부분만 남겨 다음 chunk 와 이어 훑는다
+                    cut = keep if keep is not None else max( start, len( buffer ) - overlap )
+                    pieces.append( buffer[start:cut] )
+                    buffer = buffer[cut:]
+
+    def _sep_width( pattern ):
+        """ 구분자가 chunk 경계에 걸칠 때 다시 훑어야 하는 글자 수 ( 구분자의 최대 길이, 제한이 없으면 _sep_overlap ) """
+        try:
+            import re._parser as sre_parse
+        except ImportError:
+            import sre_parse
+        return min( sre_parse.parse( pattern.pattern, pattern.flags ).getwidth()[1], Corpus._sep_overlap )
+
+    def _split_docs( text, pattern ):
+        start = 0
+        for m in pattern.finditer( text ):
+            if m.end() == m.start(): continue
+            yield text[start:m.start()].strip()
+            start = m.end()
+        yield text[start:].strip()
+
     def extract(self, type="string"):  # type = [string, list]
+        if self.streaming:
+            # streaming mode 에서는 호출할 때마다 file 을 다시 읽어 전체를 만든다
+            return "\n\n".join( self.iter_texts() ) if type == "string" else list( self.iter_docs() )
         if self._docs == []:
             self._text2docs()
         if type == "string":
@@ -79,7 +209,10 @@ class Corpus:
 
     def export(self, output_filename, plain_text=True ):
         stream = open(output_filename, 'w', encoding="utf-8")
-        if plain_text:
+        if plain_text and self.streaming:
+            for i, doc in enumerate( self.iter_texts() ):
+                stream.write( ( "\n\n" if i > 0 else "" ) + doc )
+        elif plain_text:
             stream.write( self.extract(type="string") )
         else:
             yaml.dump( self.extract(type="list"), stream, default_flow_style=False,  allow_unicode=True )
@@ -89,13 +222,57 @@ class Corpus:
 
     @staticmethod
     def merge_chrs( text, dict_path ):
-        dic = open(dict_path, 'r', encoding='utf-8').readlines()
+        """ dict_path 는 경로 하나 또는 경로 list. 사전 순서대로 치환한 결과와 같다 """
         _text = text + ""
-        for pair in dic:
-            a, b = re.split( r"[ \t]+", pair )
-            _text = _text.replace( a.strip(), b.strip() )
+        for step in Corpus.compile_chr_map( dict_path ):
+            if step[0] == "table":
+                _text = _text.translate( step[1] )
+            else:
+                _text = _text.replace( step[1], step[2] )
         return _text
 
+    @staticmethod
+    def compile_chr_map( dict_paths ):
+        """ 사전들을 치환 단계 list 로 compile ( 경로별 cache )
+        1:1 문자 치환이 이어지는 구간은 앞선 치환의 연쇄( a→b, b→c )까지 반영한 하나의 translate table 로 합치고,
+        여러 글자로 된 항목만 str.replace 단계로 남긴다 """
+        _paths = [ dict_paths ] if isinstance( dict_paths, str ) else list( dict_paths )
+        key = tuple( Corpus._resolve_dict_path( path ) for path in _paths )
+        if key in Corpus._chr_maps:
+            return Corpus._chr_maps[ key ]
+
+        steps = []
+        image, holders = {}, {}     # 원래 문자 -> 현재 치환 결과, 문자 -> 그 문자를 결과에 포함한 원래 문자들
+        for path in key:
+            for pair in open( path, 'r', encoding='utf-8-sig' ):
+                if not pair.strip(): continue
+                _pair = re.split( r"[ \t]+", pair.strip(), maxsplit=1 )
+                a, b = _pair[0], ( _pair[1].strip() if len( _pair ) > 1 else "" )
+                if len( a ) != 1:
+                    if image:
+                        steps.append( ( "table", str.maketrans( image ) ) )
+                        image, holders = {}, {}
+                    steps.append( ( "replace", a, b ) )
+                    continue
+                for x in list( holders.pop( a, [] ) ):
+                    image[ x ] = image[ x ].replace( a, b )
+                    for c in image[ x ]:
+                        holders.setdefault( c, set() ).add( x )
+                if a not in image:
+                    image[ a ] = b
+                    for c in b:
+                        holders.setdefault( c, set() ).add( a )
+        if image:
+            steps.append( ( "table", str.maketrans( image ) ) )
+
+        Corpus._chr_maps[ key ] = steps
+        return steps
+
+    def _resolve_dict_path( dict_path ):
+        if os.path.isabs( dict_path ) or os.path.exists( dict_path ):
+            return os.path.abspath( dict_path )
+        return pkg_resources.resource_filename( __name__ , dict_path )
+
     def tokenize( line, sep="[ \t]+" ):
         _tokens = list( map( lambda x: x.strip(), re.split( re.compile( sep ), line ) ) )
         tokens = list( filter( None, _tokens ) )    # remove empty string
@@ -111,3 +288,69 @@ class Corpus:
         for i in range(min_window, mx_wd + 1):
             rst += Corpus.ngram(text, i)
         return rst
+
+
+class Cleaner:
+    """ Corpus 의 정제 method 들을 하나의 pass 로 합친 것
+    문자 치환( merge_* )은 translate table 하나로, 삭제 단계들은 하나의 정규식으로 묶고,
+    merge_spaces 는 삭제 대상과 공백을 한 덩어리로 보고 같은 pass 안에서 처리한다.
+    단계들의 pattern 이 서로 겹치지 않는 한 같은 순서로 method 를 연쇄 호출한 결과와 같다. """
+
+    chr_patterns = { "Korean": "[가-힣]+", "Alphabet": "[a-zA-Z]+", "Numbers": "[\d]+" }
+    merge_steps = [ "merge_duplications", "merge_variants", "normalize" ]
+    remove_steps = [ "remove_comments", "remove_punctuation", "remove_chrs" ]
+
+    def __init__( self, steps ):
+        self.steps = [ self.__class__._step_kwargs( step ) for step in steps ]
+        self.step_names = [ name for name, _ in self.steps ]
+
+        _dict_paths = []
+        for name, kwargs in self.steps:
+            if name == "normalize":
+                _dict_paths += list( Corpus.default_dicts if kwargs["dict_paths"] is None else kwargs["dict_paths"] ) + list( kwargs["user_dict_paths"] )
+            elif name in self.merge_steps:
+                _dict_paths.append( kwargs["dict_path"] )
+        self.chr_map = Corpus.compile_chr_map( _dict_paths ) if _dict_paths else []
+
+        # merge_spaces 를 경계로 pass 를 나눈다 ( 보통은 맨 끝에 한 번 )
+        self.passes = []
+        _alts = []
+        for name, kwargs in self.steps:
+            if name == "remove_comments":
+                _alts.append( "{}.*?$".format( kwargs["comments_header"] ) )
+            elif name == "remove_punctuation":
+                _alts.append( kwargs["punctuations"] )
+            elif name == "remove_chrs":
+                _alts += [ self.chr_patterns[ tp ] for tp in self.chr_patterns if tp in kwargs["chr_types"] ]
+            elif name == "merge_spaces":
+                self.passes.append( self.__class__._compile_pass( _alts, True ) )
+                _alts = []
+        if _alts:
+            self.passes.append( self.__class__._compile_pass( _alts, False ) )
+
+    def __call__( self, text ):
+        _text = text
+        for step in self.chr_map:
+            _text = _text.translate( step[1] ) if step[0] == "table" else _text.replace( step[1], step[2] )
+        for pattern, merge_spaces in self.passes:
+            _text = re.sub( pattern, self.__class__._merged_space if merge_spaces else " ", _text ).strip()
+        return _text
+
+    def _step_kwargs( step ):
+        name, kwargs = ( step, {} ) if isinstance( step, str ) else ( step[0], dict( step[1] ) if len( step ) > 1 else {} )
+        if not ( name in Cleaner.merge_steps or name in Cleaner.remove_steps or name == "merge_spaces" ):
+            raise ValueError( "Unknown cleaning step: {}".format( name ) )
+        _kwargs = { k: v.default for k, v in inspect.signature( getattr( Corpus, name ) ).parameters.items() if k != "self" }
+        _kwargs.update( kwargs )
+        return ( name, _kwargs )
+
+    def _compile_pass( alts, merge_spaces ):
+        if merge_spaces:
+            unit = "(?:{})".format( "|".join( alts + [ "[ \t]" ] ) )
+            pattern = "(^{0}+)|{0}+".format( unit )
+        else:
+            pattern = "|".join( alts )
+        return ( re.compile( pattern, re.MULTILINE|re.DOTALL ), merge_spaces )
+
+    def _merged_space( m ):
+        return "" if m.group(1) is not None else " "
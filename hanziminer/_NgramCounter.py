@@ -0,0 +1,273 @@
+# -*- encoding:utf8 -*-
+
+from collections import defaultdict
+from collections.abc import Mapping
+import numpy as np
+from hanziminer import Tools
+
+
+class NgramCounter( Mapping ):
+    """ 문자를 정수 id 로 바꾸어 n-gram 빈도를 numpy 배열에 세는 Counter
+    level n 의 n-gram 은 ( 앞 n-1 gram 의 id << 32 | 마지막 문자 id ) 를 key 로 id 를 받는다.
+    id 는 처음 나온 순서대로 붙여 나중에 추가해도 바뀌지 않는다. min_n ~ max_n 길이만 Counter 처럼 보인다 """
+
+    _mask = ( 1 << 32 ) - 1
+
+    def __init__( self, min_n=1, max_n=9 ):
+        self.min_n, self.max_n = min_n, max_n
+        self.codepoints = []                                # 문자 id -> code point
+        self.char_index = {}                                # code point -> 문자 id
+        self._keys = [ None ] + [ np.zeros( 0, dtype=np.int64 ) for n in range( max_n ) ]     # id 순서의 key
+        self._sorted_keys = [ None ] + [ np.zeros( 0, dtype=np.int64 ) for n in range( max_n ) ]
+        self._sorted_ids = [ None ] + [ np.zeros( 0, dtype=np.int64 ) for n in range( max_n ) ]
+        self._counts = [ None ] + [ np.zeros( 0, dtype=np.int64 ) for n in range( max_n ) ]
+
+    @classmethod
+    def from_counter( cls, counter, min_n=1, max_n=9 ):
+        """ token -> 빈도 Counter 를 NgramCounter 로 바꾼다 ( 중간 길이의 접두 n-gram 은 빈도 0 으로 만든다 ) """
+        table = cls( min_n, max_n )
+        _by_len = defaultdict( list )
+        for token, count in counter.items():
+            if 1 <= len( token ) <= max_n and count:
+                _by_len[ len( token ) ].append( ( token, count ) )
+        for n in sorted( _by_len ):
+            tokens, counts = zip( *_by_len[n] )
+            chars = table._encode( "".join( tokens ), add=True ).reshape( -1, n )
+            counts = np.asarray( counts, dtype=np.int64 )
+            gids = table._add_keys( 1, chars[:, 0], counts if n == 1 else np.zeros( len( counts ), dtype=np.int64 ) )
+            for k in range( 2, n + 1 ):
+                gids = table._add_keys( k, ( gids << 32 ) | chars[:, k-1], counts if k == n else np.zeros( len( counts ), dtype=np.int64 ) )
+        return table
+
+    def subset( self, min_n, max_n ):
+        """ 배열을 공유하면서 보이는 길이만 다른 counter ( e.g. bigram counter ) """
+        _view = self.__class__.__new__( self.__class__ )
+        _view.__dict__.update( self.__dict__ )
+        _view.min_n, _view.max_n = min_n, max_n
+        return _view
+
+    def add_phrases( self, phrases ):
+        """ 공백 없는 phrase 들의 1 ~ max_n gram 을 센다 ( Corpus.allgram( phrase, 1, max_n ) 을 센 것과 같다 ) """
+        seq = self._encode( " ".join( phrases ), add=True )
+        gids = self._add_keys( 1, seq[ seq >= 0 ] )
+        prev = np.full( len( seq ), -1, dtype=np.int64 )
+        prev[ seq >= 0 ] = gids
+        for n in range( 2, self.max_n + 1 ):
+            cur, nxt = prev[:-1], seq[n-1:]
+            valid = ( cur >= 0 ) & ( nxt >= 0 )
+            if not valid.any(): break
+            prev = np.full( len( cur ), -1, dtype=np.int64 )
+            prev[ valid ] = self._add_keys( n, ( cur[ valid ] << 32 ) | nxt[ valid ] )
+        return self
+
+    def save( self, path ):
+        """ level 별 배열을 path 폴더에 .npy 파일로 저장한다 """
+        arrays = { "codepoints": np.asarray( self.codepoints, dtype=np.int64 ) }
+        for n in range( 1, self.max_n + 1 ):
+            arrays[ "keys_{}".format( n ) ] = self._keys[n]
+            arrays[ "sorted_keys_{}".format( n ) ] = self._sorted_keys[n]
+            arrays[ "sorted_ids_{}".format( n ) ] = self._sorted_ids[n]
+            arrays[ "counts_{}".format( n ) ] = self._counts[n]
+        Tools.save_arrays( path, arrays, { "min_n": self.min_n, "max_n": self.max_n } )
+        return self
+
+    @classmethod
+    def load( cls, path, mmap_mode="c" ):
+        """ save() 한 counter 를 읽는다. mmap_mode="c" 는 고치기 전까지 process 들이 같은 page 를 나누어 쓴다 """
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        table = cls( meta["min_n"], meta["max_n"] )
+        table.codepoints = arrays["codepoints"].tolist()
+        table.char_index = { cp: i for i, cp in enumerate( table.codepoints ) }
+        for n in range( 1, table.max_n + 1 ):
+            table._keys[n] = arrays[ "keys_{}".format( n ) ]
+            table._sorted_keys[n] = arrays[ "sorted_keys_{}".format( n ) ]
+            table._sorted_ids[n] = arrays[ "sorted_ids_{}".format( n ) ]
+            table._counts[n] = arrays[ "counts_{}".format( n ) ]
+        return table
+
+    def merge( self, other ):
+        """ 다른 NgramCounter 의 빈도를 더한다 ( other 의 문자 id, n-gram id 를 이 counter 의 id 로 바꾸어 level 별로 합친다 ) """
+        self.add_counts( other )
+        return self
+
+    def add_counts( self, other, sign=1 ):
+        """ other 의 빈도를 sign 을 곱해 더하고 ( 0 아래로는 내려가지 않는다 ), 바뀐 항목을 돌려준다
+        { n : ( id 배열, 바뀌기 전 빈도, 바뀐 뒤 빈도 ) } """
+        cmap = np.asarray( [ self._char_id( cp ) for cp in other.codepoints ], dtype=np.int64 )
+        remap = None
+        changes = {}
+        for n in range( 1, min( self.max_n, other.max_n ) + 1 ):
+            okeys = other._keys[n]
+            if len( okeys ) == 0: break
+            keys = cmap[ okeys ] if n == 1 else ( remap[ okeys >> 32 ] << 32 ) | cmap[ okeys & self._mask ]
+            remap = self._add_keys( n, keys, sign * other._counts[n], changes )
+        return changes
+
+    def _char_id( self, cp ):
+        if cp not in self.char_index:
+            self.char_index[ cp ] = len( self.codepoints )
+            self.codepoints.append( cp )
+        return self.char_index[ cp ]
+
+    def _encode( self, text, add=False ):
+        """ 문자열 -> 문자 id 배열 ( 공백 및 모르는 문자는 -1 ) """
+        cps = np.frombuffer( text.encode( "utf-32-le" ), dtype=np.uint32 ).astype( np.int64 )
+        ucps, inv = np.unique( cps, return_inverse=True )
+        uids = np.empty( len( ucps ), dtype=np.int64 )
+        for i, cp in enumerate( ucps.tolist() ):
+            if cp == 32:
+                uids[i] = -1
+            elif cp in self.char_index:
+                uids[i] = self.char_index[ cp ]
+            elif add:
+                uids[i] = self._char_id( cp )
+            else:
+                uids[i] = -1
+        return uids[ inv.reshape( -1 ) ]
+
+    def _lookup_keys( self, n, keys ):
+        """ level n 에서 key 배열의 id ( 없으면 -1 ) """
+        skeys = self._sorted_keys[n]
+        if len( skeys ) == 0:
+            return np.full( len( keys ), -1, dtype=np.int64 )
+        idx = np.minimum( np.searchsorted( skeys, keys ), len( skeys ) - 1 )
+        return np.where( skeys[ idx ] == keys, self._sorted_ids[n][ idx ], -1 )
+
+    def _add_keys( self, n, keys, counts=None, changes=None ):
+        """ level n 에 key 들의 빈도를 더하고 각 key 의 id 를 돌려준다 """
+        ukeys, inv, ucounts = np.unique( keys, return_inverse=True, return_counts=True )
+        if counts is not None:
+            ucounts = np.zeros( len( ukeys ), dtype=np.int64 )
+            np.add.at( ucounts, inv.reshape( -1 ), counts )
+        gids = self._lookup_keys( n, ukeys )
+        new = gids < 0
+        n_old, n_new = len( self._keys[n] ), int( new.sum() )
+        if n_new:
+            gids[ new ] = np.arange( n_old, n_old + n_new, dtype=np.int64 )
+            # 새 key 는 이미 정렬되어 있으므로 정렬 순서를 다시 만들지 않고 끼워 넣는다
+            at = np.searchsorted( self._sorted_keys[n], ukeys[ new ] )
+            self._sorted_keys[n] = np.insert( self._sorted_keys[n], at, ukeys[ new ] )
+            self._sorted_ids[n] = np.insert( self._sorted_ids[n], at, gids[ new ] )
+            self._keys[n] = np.concatenate( [ self._keys[n], ukeys[ new ] ] )
+            self._counts[n] = np.concatenate( [ self._counts[n], np.zeros( n_new, dtype=np.int64 ) ] )
+        before = self._counts[n][ gids ]
+        self._counts[n][ gids ] = np.maximum( before + ucounts, 0 )
+        if changes is not None:
+            changes[n] = ( gids, before, self._counts[n][ gids ] )
+        return gids[ inv.reshape( -1 ) ]
+
+    def ids( self, tokens ):
+        """ 길이가 같은 token 들의 level id 배열 ( 없으면 -1 ) """
+        tokens = list( tokens )
+        if not tokens:
+            return np.zeros( 0, dtype=np.int64 )
+        n = len( tokens[0] )
+        if n < 1 or n > self.max_n:
+            return np.full( len( tokens ), -1, dtype=np.int64 )
+        return self._chain_ids( self._encode( "".join( tokens ) ).reshape( -1, n ) )
+
+    def _chain_ids( self, chars ):
+        """ ( m, n ) 문자 id 행렬 -> level n id 배열 ( 없으면 -1 ) """
+        gids = np.where( chars[:, 0] >= 0, self._lookup_keys( 1, chars[:, 0] ), -1 )
+        for k in range( 2, chars.shape[1] + 1 ):
+            ok = ( gids >= 0 ) & ( chars[:, k-1] >= 0 )
+            gids = np.where( ok, self._lookup_keys( k, np.where( ok, ( gids << 32 ) | chars[:, k-1], -1 ) ), -1 )
+        return gids
+
+    def prefix_ids( self, n ):
+        """ level n 의 각 n-gram 에서 마지막 글자를 뺀 n-1 gram 의 id """
+        return self._keys[n] >> 32
+
+    def suffix_ids( self, n, ids=None ):
+        """ level n 의 각 n-gram 에서 첫 글자를 뺀 n-1 gram 의 id ( 없으면 -1 ) """
+        chars = self.char_ids( n, np.arange( len( self._keys[n] ) ) if ids is None else ids )
+        return self._chain_ids( chars[:, 1:] )
+
+    def decode( self, n, ids ):
+        """ level n id 배열 -> token 문자열 list """
+        chars = self.char_ids( n, ids )
+        text = np.asarray( self.codepoints, dtype=np.uint32 )[ chars ].tobytes().decode( "utf-32-le" )
+        return [ text[i:i+n] for i in range( 0, len( text ), n ) ]
+
+    def char_ids( self, n, ids ):
+        """ level n id 배열 -> ( len(ids), n ) 문자 id 행렬 """
+        mat = np.empty( ( len( ids ), n ), dtype=np.int64 )
+        cur = np.asarray( ids, dtype=np.int64 )
+        for k in range( n, 1, -1 ):
+            keys = self._keys[k][ cur ]
+            mat[:, k-1] = keys & self._mask
+            cur = keys >> 32
+        mat[:, 0] = self._keys[1][ cur ]
+        return mat
+
+    def counts( self, n ):
+        """ level n 의 빈도 배열 ( id 순서 ) """
+        return self._counts[n]
+
+    def levels( self ):
+        return range( self.min_n, self.max_n + 1 )
+
+    # Counter 와 같은 읽기 interface
+    def __getitem__( self, token ):
+        n = len( token )
+        if n < self.min_n or n > self.max_n:
+            return 0
+        gid = self.ids( [ token ] )[0]
+        return int( self._counts[n][ gid ] ) if gid >= 0 else 0
+
+    def __contains__( self, token ):
+        return isinstance( token, str ) and self[ token ] > 0
+
+    def get( self, token, default=None ):
+        return self[ token ] if token in self else default
+
+    def __iter__( self ):
+        for token, count in self.items():
+            yield token
+
+    def __len__( self ):
+        return sum( int( ( self._counts[n] > 0 ).sum() ) for n in self.levels() )
+
+    def items( self ):
+        for n in self.levels():
+            gids = np.flatnonzero( self._counts[n] > 0 )
+            for token, count in zip( self.decode( n, gids ), self._counts[n][ gids ].tolist() ):
+                yield ( token, count )
+
+    def keys( self ):
+        return iter( self )
+
+    def values( self ):
+        for n in self.levels():
+            for count in self._counts[n][ self._counts[n] > 0 ].tolist():
+                yield count
+
+    def total( self ):
+        return sum( int( self._counts[n].sum() ) for n in self.levels() )
+
+    def most_common( self, k=None ):
+        return sorted( self.items(), key=lambda x: x[1], reverse=True )[:k]
+
+
+class NgramValues( Mapping ):
+    """ n-gram 표( NgramCounter, SuffixIndex )의 level id 에 맞춘 값 배열을 token 으로 조회하는 dict 같은 view
+    values : { n : level n 의 id 순서 배열 }. 없는 token 은 0 """
+
+    def __init__( self, table, values ):
+        self.table = table
+        self.values_by_level = values
+
+    def __getitem__( self, token ):
+        n = len( token )
+        if n not in self.values_by_level:
+            return 0
+        gid = self.table.ids( [ token ] )[0]
+        return float( self.values_by_level[n][ gid ] ) if 0 <= gid < len( self.values_by_level[n] ) else 0
+
+    def __iter__( self ):
+        for n in sorted( self.values_by_level ):
+            for token in self.table.decode( n, np.arange( len( self.values_by_level[n] ) ) ):
+                yield token
+
+    def __len__( self ):
+        return sum( len( v ) for v in self.values_by_level.values() )
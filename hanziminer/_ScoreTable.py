@@ -0,0 +1,95 @@
+# -*- encoding:utf8 -*-
+
+from collections import namedtuple
+from collections.abc import Mapping
+import numpy as np
+from hanziminer import Tools
+
+
+class ScoreTable( Mapping ):
+    """ token 별 점수를 열( column ) 배열로 모아 둔 표
+    token 은 정렬된 고정 길이 unicode 배열에서 이진 탐색으로 찾고, score[token] 은 namedtuple 을 돌려준다.
+    save() 한 표는 load() 에서 mmap 으로 읽어 여러 process 가 한 벌을 나누어 쓴다 """
+
+    def __init__( self, header, tokens=(), columns=None ):
+        self.header = list( header )
+        self._tpl = namedtuple( 'Score', self.header )
+        tokens = np.asarray( list( tokens ) if not isinstance( tokens, np.ndarray ) else tokens, dtype=np.str_ )
+        order = np.argsort( tokens, kind="stable" )
+        self.tokens = tokens[ order ]
+        columns = columns or {}
+        self.columns = { h: np.asarray( columns[h] )[ order ] if h in columns else np.zeros( len( tokens ) ) for h in self.header }
+
+    def rows( self, tokens ):
+        """ token 들의 행 번호 배열 ( 없으면 -1 ) """
+        tokens = np.asarray( tokens, dtype=np.str_ )
+        if len( self.tokens ) == 0:
+            return np.full( len( tokens ), -1, dtype=np.int64 )
+        idx = np.minimum( np.searchsorted( self.tokens, tokens ), len( self.tokens ) - 1 )
+        return np.where( self.tokens[ idx ] == tokens, idx, -1 )
+
+    def column( self, name ):
+        return self.columns[ name ]
+
+    def set_rows( self, tokens, columns ):
+        """ token 들의 점수를 고치거나 새로 넣는다 ( columns : { 열 이름 : 값 배열 } ) """
+        tokens = np.asarray( tokens, dtype=np.str_ )
+        rows = self.rows( tokens )
+        old = rows >= 0
+        for h in self.header:
+            self.columns[h] = np.array( self.columns[h] )   # mmap 으로 읽은 배열도 고칠 수 있게 복사한다
+            self.columns[h][ rows[ old ] ] = np.asarray( columns[h] )[ old ]
+        if ( ~old ).any():
+            new = self.__class__( self.header, tokens[ ~old ], { h: np.asarray( columns[h] )[ ~old ] for h in self.header } )
+            at = np.searchsorted( self.tokens, new.tokens )
+            self.tokens = np.insert( self.tokens.astype( np.result_type( self.tokens, new.tokens ) ), at, new.tokens )
+            for h in self.header:
+                self.columns[h] = np.insert( self.columns[h], at, new.columns[h] )
+        return self
+
+    def drop( self, tokens ):
+        rows = self.rows( tokens )
+        rows = rows[ rows >= 0 ]
+        self.tokens = np.delete( self.tokens, rows )
+        for h in self.header:
+            self.columns[h] = np.delete( self.columns[h], rows )
+        return self
+
+    def save( self, path ):
+        """ path 폴더에 열마다 .npy 파일로 저장한다 """
+        arrays = { "column_{}".format( h ): self.columns[h] for h in self.header }
+        arrays["tokens"] = self.tokens
+        Tools.save_arrays( path, arrays, { "header": self.header } )
+        return self
+
+    @classmethod
+    def load( cls, path, mmap_mode="c" ):
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        table = cls( meta["header"] )
+        table.tokens = arrays["tokens"]
+        table.columns = { h: arrays[ "column_{}".format( h ) ] for h in table.header }
+        return table
+
+    # dict 와 같은 읽기 interface
+    def __getitem__( self, token ):
+        row = self.rows( [ token ] )[0]
+        if row < 0:
+            raise KeyError( token )
+        return self._tpl( *[ self.columns[h][ row ].item() for h in self.header ] )
+
+    def __contains__( self, token ):
+        return isinstance( token, str ) and self.rows( [ token ] )[0] >= 0
+
+    def __iter__( self ):
+        return iter( self.tokens.tolist() )
+
+    def __len__( self ):
+        return len( self.tokens )
+
+    def items( self ):
+        for token, *values in zip( self.tokens.tolist(), *[ self.columns[h].tolist() for h in self.header ] ):
+            yield ( token, self._tpl( *values ) )
+
+    def values( self ):
+        for token, score in self.items():
+            yield score
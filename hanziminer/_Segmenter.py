@@ -1,109 +1,329 @@
 # -*- encoding:utf8 -*-
 
-from collections import defaultdict, namedtuple, Counter
-from hanziminer import Corpus, Tools
+from collections import defaultdict, Counter
+from itertools import islice
+from array import array
+import multiprocessing
+import numpy as np
+from hanziminer import Corpus, Tools, Trie, LRUCache
 import re
 
-class SegmenterScore:
+class SegmenterBase:
+    """ 세 segmenter 가 함께 쓰는 corpus 단위 분할과 문장 cache """
+
+    _state_fields = ( "spans", "list_segmented" )     # cache 에 두고 다시 꺼내는 문장 상태
+    _sentence_fields = ( "target_text", "_entry", "matches", "token_candis", "spans", "list_segmented" )   # pickle 때 빼는 문장 상태
+
+    def use_cache( self, maxsize=100000 ):
+        """ 같은 문장이 다시 load 되면 후보 찾기와 분할을 건너뛰고 cache 의 결과를 쓴다 ( maxsize=0 이면 끈다 ) """
+        self._cache = LRUCache( maxsize ) if maxsize else None
+        return self
+
+    def cache_info( self ):
+        """ ( hits, misses, maxsize, currsize ). cache 를 쓰지 않으면 None """
+        return self._cache.cache_info() if getattr( self, "_cache", None ) is not None else None
+
+    def _load_entry( self, key ):
+        """ 문장 하나의 cache 항목 ( 상태 이름 -> 속성 dict ). cache 를 쓰지 않으면 빈 dict """
+        cache = getattr( self, "_cache", None )
+        if cache is None:
+            return {}
+        entry = cache.get( key )
+        if entry is None:
+            entry = {}
+            cache[ key ] = entry
+        return entry
+
+    def _cached_state( self, key, func ):
+        """ 지금 문장의 key 상태를 cache 에서 꺼내거나 func() 로 구해 넣고 _state_fields 의 속성으로 둔다
+            호출한 쪽이 결과를 고쳐도 cache 가 바뀌지 않도록 tuple 로 넣는다 """
+        if key not in self._entry:
+            self._entry[ key ] = { name: tuple( value ) for name, value in func().items() if name in self._state_fields }
+        state = self._entry[ key ]
+        for name in self._state_fields:
+            if name in state:
+                setattr( self, name, state[ name ] )
+        return self
+
+    def __getstate__( self ):
+        """ process pool 로 보낼 때는 지금 문장의 상태와 cache 내용을 빼고 분할에 필요한 것만 보낸다 ( cache 는 같은 크기로 비워 둔다 ) """
+        state = { name: value for name, value in self.__dict__.items() if name not in self._sentence_fields }
+        if state.get( "_cache" ) is not None:
+            state[ "_cache" ] = LRUCache( state[ "_cache" ].maxsize )
+        return state
+
+    def segment_corpus( self, lines_or_file, output_filename=None, workers=1, chunk_size=1000, keyword_only=False, sep=" ", **segment_args ):
+        """ 문장 list 또는 파일( 한 줄에 한 문장 )을 chunk_size 줄씩 읽어 나누고, 순서대로 to_list() 결과를 모은다
+            workers : 2 이상이면 process pool 에서 나눈다 ( fork 에서는 segmenter 를 복사 없이 나누어 쓰고, spawn 에서는 __getstate__ 의 것만 보낸다 )
+            output_filename : 주면 결과를 모으지 않고 한 줄씩 sep 으로 이어 바로 쓴다 """
+        _handler = open( lines_or_file, encoding="utf-8" ) if isinstance( lines_or_file, str ) else None
+        _lines = ( line.rstrip( "\r\n" ) for line in _handler ) if _handler else iter( lines_or_file )
+        _chunks = iter( lambda: list( islice( _lines, chunk_size ) ), [] )
+        _args = ( keyword_only, segment_args )
+        _output = open( output_filename, "w", encoding="utf-8" ) if output_filename else None
+        rst = []
+        n_lines = 0
+
+        if workers > 1:
+            _pool = multiprocessing.Pool( workers, initializer=_init_segment_worker, initargs=( self, ) )
+            _results = _pool.imap( _segment_chunk, ( ( chunk, ) + _args for chunk in _chunks ) )
+        else:
+            _pool = None
+            _results = ( self._segment_chunk( chunk, *_args ) for chunk in _chunks )
+        try:
+            for segmented in _results:
+                if _output:
+                    _output.write( "".join( sep.join( tokens ) + "\n" for tokens in segmented ) )
+                else:
+                    rst += segmented
+                n_lines += len( segmented )
+                Tools.print_counter( n_lines, prefix='Progress', suffix='lines', every=chunk_size )
+        finally:
+            if _pool: _pool.close(); _pool.join()
+            if _handler: _handler.close()
+            if _output: _output.close()
+        Tools.print_counter( n_lines, prefix='Progress', suffix='lines', done=True )
+        if _output:
+            print("# {:d} lines were segmented in {}".format( n_lines, output_filename ))
+            return self
+        return rst
+
+    def vocabulary( self ):
+        """ token id -> token """
+        return self.trie.tokens
+
+    def to_spans( self, as_numpy=False ):
+        """ 문자열을 만들지 않고 ( 시작, 끝, token id ) 를 이어 붙인 array('I') 로 돌려준다 ( as_numpy 이면 ( token 수, 3 ) int32 배열 )
+            위치는 load 한 문장의 index, token id 는 vocabulary() 의 순서 """
+        _spans = array( 'I', [ x for span in self.spans for x in span ] )
+        return np.frombuffer( _spans, dtype=np.uint32 ).astype( np.int32 ).reshape( -1, 3 ) if as_numpy else _spans
+
+    def _span_pieces( self ):
+        """ spans 사이의 글자와 token 을 순서대로 ( 문자열, token id 또는 -1 ) 로 돌려준다 """
+        pieces, cur = [], 0
+        for b, e, tid in self.spans:
+            if b > cur: pieces.append( ( self.target_text[cur:b], -1 ) )
+            pieces.append( ( self.target_text[b:e], tid ) )
+            cur = e
+        if cur < len( self.target_text ): pieces.append( ( self.target_text[cur:], -1 ) )
+        return pieces
+
+    def _segment_chunk( self, lines, keyword_only, segment_args ):
+        return [ self._segment_line( line, keyword_only, segment_args ) for line in lines ]
+
+    def _segment_line( self, line, keyword_only, segment_args ):
+        return self.load( line ).segment( **segment_args ).to_list( keyword_only=keyword_only )
+
+
+class SegmenterScore( SegmenterBase ):
+
+    _state_fields = ( "matches", "token_candis", "spans" )
 
     def __init__( self, token_with_score, method="cohesion", score_cutoff=0):
         self.score_list = [ ( tk, getattr( sc, method ) ) for tk, sc in token_with_score.items() if getattr( sc, method ) >= score_cutoff  ]
         self.score = dict( self.score_list )
-        self.tokens = self.score.keys()
+        self.tokens = list( self.score )
+        # 어휘의 automaton 은 한 번만 만들어 모든 문장에 다시 쓴다
+        self.trie = Trie( self.tokens )
+
+    def __getstate__( self ):
+        """ score_list, tokens 는 score 에서 다시 만든다 """
+        state = SegmenterBase.__getstate__( self )
+        del state[ "score_list" ], state[ "tokens" ]
+        return state
+
+    def __setstate__( self, state ):
+        self.__dict__.update( state )
+        self.score_list = list( self.score.items() )
+        self.tokens = list( self.score )
 
     def load( self, text, min_window=2, max_window=8 ):
         self.target_text = text
-        _token_candis = set( Corpus.allgram(text, min_window, max_window) )
-        token_candis_with_score = [ ( it, self.score[it] ) for it in _token_candis if it in self.tokens ]
-        self.token_candis = sorted( token_candis_with_score, key=lambda x: (-x[1], -len(x[0] )  ) )
-        return self
+        self._entry = self._load_entry( ( text, min_window, max_window ) )
+        return self._cached_state( "load", lambda: self._load( text, min_window, max_window ) )
 
-    def segment( self, segment_marker="%" ):
-        target_text = self.target_text + ""
-        self.segment_marker = segment_marker
-        for i, candi in enumerate( self.token_candis ):
-            marker = "{0}{0}{1}{0}{0}".format( self.segment_marker, i )
-            target_text = marker.join( target_text.split( candi[0] ) )
+    def _load( self, text, min_window, max_window ):
+        matches = self.trie.find_all( text, min_window, max_window )
+        _token_candis = set( self.trie.tokens[ tid ] for b, e, tid in matches )
+        token_candis_with_score = [ ( it, self.score[it] ) for it in _token_candis ]
+        return { "matches": matches, "token_candis": sorted( token_candis_with_score, key=lambda x: (-x[1], -len(x[0] )  ) ) }
 
-        self.text_segment_marked = target_text
-        return self
+    def segment( self, segment_marker="%", method="greedy" ):
+        """ method : "greedy" ( 점수가 높은 후보부터 아직 덮이지 않은 출현을 왼쪽부터 차지한다 ) 또는
+            "viterbi" ( 후보 격자에서 Σ 점수 × 길이 가 가장 큰 분할을 DP 로 구한다 )
+            결과는 token 위치( spans )로 남는다. segment_marker 는 예전 호출과 맞추려고 남겨 둔다 """
+        if method == "viterbi":
+            return self._cached_state( ( "viterbi", ), self._segment_viterbi )
+        return self._cached_state( ( "greedy", ), self._segment_greedy )
+
+    def _segment_greedy( self ):
+        """ 후보마다 그 출현들을 왼쪽부터 겹치지 않게 고른다 ( 이미 덮인 글자에 걸리면 건너뛴다 ) """
+        _covered = [ False ] * len( self.target_text )
+        _occurs = defaultdict( list )
+        for b, e, tid in sorted( self.matches ):
+            _occurs[ self.trie.tokens[ tid ] ].append( ( b, e, tid ) )
+        spans = []
+        for token, _score in self.token_candis:
+            last = 0
+            for b, e, tid in _occurs[ token ]:
+                if b < last or any( _covered[b:e] ): continue
+                _covered[b:e] = [ True ] * ( e - b )
+                spans.append( ( b, e, tid ) )
+                last = e
+        return { "spans": sorted( spans ) }
+
+    def _segment_viterbi( self ):
+        """ best[i] : text[:i] 의 최고 점수. 글자 하나를 건너뛰거나 i 에서 끝나는 후보 하나를 붙인다 ( O( 문장 길이 × max_window ) ) """
+        size = len( self.target_text )
+        _ends = defaultdict( list )
+        for b, e, tid in self.matches:
+            _ends[ e ].append( ( b, tid ) )
+        best, back = [ 0.0 ] * ( size + 1 ), [ None ] * ( size + 1 )
+        for i in range( 1, size + 1 ):
+            best[i] = best[i-1]
+            # 같은 점수면 먼저 나오는 긴 후보를 쓴다
+            for b, tid in _ends[i]:
+                _score = best[b] + self.score[ self.trie.tokens[ tid ] ] * ( i - b )
+                if _score > best[i]:
+                    best[i], back[i] = _score, ( b, tid )
+        spans = []
+        i = size
+        while i > 0:
+            if back[i] is None:
+                i -= 1
+            else:
+                b, tid = back[i]
+                spans.append( ( b, i, tid ) )
+                i = b
+        return { "spans": spans[::-1] }
 
     def to_string( self, verbose=False, keyword_only=False, sep=" " ):
-        target_text = self.text_segment_marked + ""
         if keyword_only:
             self.text_segmented = sep.join( self.to_list(verbose=False, keyword_only=True) )
         else:
-            for i, candi in enumerate( self.token_candis ):
-                marker = "{0}{0}{1}{0}{0}".format( self.segment_marker, i )
-                seg = "【{0}/{1:01.3f}】".format( candi[0], candi[1] ) if verbose else "【{}】".format( candi[0] )
-                target_text = target_text.replace(marker, seg )
-            self.text_segmented = target_text
+            _pieces = [ piece if tid < 0 else ( "【{0}/{1:01.3f}】".format( piece, self.score[ piece ] ) if verbose else "【{}】".format( piece ) ) for piece, tid in self._span_pieces() ]
+            self.text_segmented = "".join( _pieces )
         return self.text_segmented
 
     def to_list( self, verbose=False, keyword_only=False ):
-        target_text = self.text_segment_marked + ""
-
-        if keyword_only:
-            rg = re.compile( "\{0}\{0}\d+?\{0}\{0}".format( self.segment_marker ) )
-            _segment_list = re.findall( rg, target_text )
-            segment_list = [ self.token_candis[ int(it[2:-2]) ] for it in _segment_list ] if verbose else [ self.token_candis[ int(it[2:-2]) ][0] for it in _segment_list ]
-        else:
-            segment_list= re.split(r"[【】]", self.to_string( verbose=False, keyword_only=False ) )
-        self.list_segmented = list( filter( None, segment_list ) )
+        # 문장 안의 【】 와 섞이지 않도록 spans 에서 바로 나눈다
+        _pieces = [ ( piece, tid ) for piece, tid in self._span_pieces() if tid >= 0 or not keyword_only ]
+        self.list_segmented = [ ( piece, self.score[ piece ] ) if verbose and tid >= 0 else piece for piece, tid in _pieces ]
         return self.list_segmented
 
-class SegmenterGram:
+class SegmenterGram( SegmenterBase ):
     def __init__( self, gram_size=2 ):
         self.gram_size = gram_size
+        self.tokens = []            # token id -> gram ( 처음 나온 순서 )
+        self.token_index = {}
 
     def load( self, text ):
         self.target_text = text
+        self._entry = self._load_entry( text )
         return self
 
     def segment( self, escape="[ \t]+" ):
+        return self._cached_state( escape, lambda: self._segment( escape ) )
+
+    def _segment( self, escape ):
+        _escape = re.compile( escape )
         _grams = Corpus.ngram( self.target_text, self.gram_size )
-        self.list_segmented = [ gram for gram in _grams if not re.search( re.compile( escape ), gram ) ]
-        return self
+        spans = []
+        for i, gram in enumerate( _grams ):
+            if re.search( _escape, gram ): continue
+            if gram not in self.token_index:
+                self.token_index[ gram ] = len( self.tokens )
+                self.tokens.append( gram )
+            spans.append( ( i, i + self.gram_size, self.token_index[ gram ] ) )
+        return { "spans": spans, "list_segmented": [ self.tokens[ tid ] for b, e, tid in spans ] }
+
+    def vocabulary( self ):
+        """ token id -> gram. id 는 이 segmenter 에서 처음 나온 순서로 붙는다 """
+        return self.tokens
 
     def to_string( self, sep=" " ):
         return sep.join( self.list_segmented )
 
     def to_list( self ):
-        return self.list_segmented
+        return list( self.list_segmented )
+
+    def _segment_line( self, line, keyword_only, segment_args ):
+        return self.load( line ).segment( **segment_args ).to_list()
+
+class SegmenterDict( SegmenterBase ):
+    _methods = ['forward', 'backward', 'bidirectional']
 
-class SegmenterDict:
     def __init__( self, token_dict ):
         self.token_dict = token_dict
+        # 사전은 한 번만 trie 로 만든다
+        self.trie = Trie( token_dict )
 
     def load( self, text ):
         self.target_text = text
+        self._entry = self._load_entry( text )
         return self
 
-    def segment( self, escape="[ \t]+" ):
-        _checked = [False for i in range( len(self.target_text) ) ]
-        _tpl = namedtuple('Token', ["token", "index", "length"])
-        _sub_tokens = [ _tpl(token, self.target_text.find(token), len(token) ) for token in self.token_dict if self.target_text.find(token) >= 0 ]
-        _sub_tokens_sorted = sorted(_sub_tokens, key=lambda x: (x.index, -x.length) )  # idx, length
-        _token_candis = []
-        for _token_candi in _sub_tokens_sorted:
-            b, e = _token_candi.index, ( _token_candi.index + _token_candi.length )
-            if _checked[b] : continue
-            _checked[b:e] = [True] * _token_candi.length
-            _token_candis.append( _token_candi.token )
-        self.list_segmented = _token_candis
-        return self
+    def segment( self, escape="[ \t]+", method="forward" ):
+        """ 한 번 훑어 찾은 모든 출현에서 최장 일치로 나눈다
+            method : "forward" ( 앞에서부터 ), "backward" ( 뒤에서부터 ) 또는
+                     "bidirectional" ( 둘 중 token 수가 적고, 같으면 더 많은 글자를 덮는 쪽. 그래도 같으면 backward ) """
+        if method not in self._methods:
+            raise ValueError( "method must be one of {}".format( self._methods ) )
+        return self._cached_state( method, lambda: self._segment( method ) )
+
+    def _segment( self, method ):
+        size = len( self.target_text )
+        # 각 위치에서 시작하는 / 끝나는 가장 긴 token
+        _longest_from, _longest_to = [ None ] * ( size + 1 ), [ None ] * ( size + 1 )
+        for b, e, tid in self.trie.find_all( self.target_text ):
+            if _longest_from[b] is None or _longest_from[b][1] < e: _longest_from[b] = ( b, e, tid )
+            if _longest_to[e] is None or _longest_to[e][0] > b: _longest_to[e] = ( b, e, tid )
+
+        if method != "backward":
+            forward, i = [], 0
+            while i < size:
+                if _longest_from[i] is None: i += 1
+                else:
+                    forward.append( _longest_from[i] )
+                    i = _longest_from[i][1]
+        if method != "forward":
+            backward, i = [], size
+            while i > 0:
+                if _longest_to[i] is None: i -= 1
+                else:
+                    backward.append( _longest_to[i] )
+                    i = _longest_to[i][0]
+            backward.reverse()
+
+        if method == "forward":
+            spans = forward
+        elif method == "backward":
+            spans = backward
+        else:
+            _key = lambda spans: ( len( spans ), -1 * sum( e - b for b, e, tid in spans ) )
+            spans = forward if _key( forward ) < _key( backward ) else backward
+        return { "spans": spans, "list_segmented": [ self.trie.tokens[ tid ] for b, e, tid in spans ] }
 
     def to_string( self, keyword_only=False, sep=" " ):
         if keyword_only:
             return sep.join( self.list_segmented )
         else:
-            _tmp = self.target_text + ""
-            for token in self.list_segmented:
-                _tmp = _tmp.replace( token, "【{}】".format(token) )
-            return _tmp
+            return "".join( piece if tid < 0 else "【{}】".format( piece ) for piece, tid in self._span_pieces() )
 
     def to_list( self, keyword_only=False ):
         if keyword_only:
-            return self.list_segmented
+            return list( self.list_segmented )
         else:
-            return list( filter( None, re.split(r"[【】]", self.to_string() ) ) )
+            return [ piece for piece, tid in self._span_pieces() ]
+
+
+# process pool 의 segmenter ( fork 에서는 부모 process 의 것을 그대로 나누어 쓴다 )
+_segmenter = None
+
+def _init_segment_worker( segmenter ):
+    global _segmenter
+    _segmenter = segmenter
+
+def _segment_chunk( args ):
+    lines, keyword_only, segment_args = args
+    return _segmenter._segment_chunk( lines, keyword_only, segment_args )
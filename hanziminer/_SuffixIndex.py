@@ -0,0 +1,269 @@
+# -*- encoding:utf8 -*-
+
+from collections import Counter
+from collections.abc import Mapping
+import math
+import numpy as np
+from hanziminer import Tools
+
+
+class SuffixIndex( Mapping ):
+    """ phrase 들을 이어 붙인 문자 id 배열 위의 suffix array
+    길이 제한 없이 임의의 문자열의 빈도, 좌우 이웃 문자, branch entropy 를 index 에서 바로 구한다.
+    memory 는 corpus 길이에 비례한다 ( n-gram 을 따로 세지 않는다 ).
+    Counter 처럼 읽을 수 있고, items() 는 min_n ~ max_n 길이의 n-gram 을 SA 의 구간으로 나열한다 """
+
+    def __init__( self, min_n=1, max_n=9 ):
+        self.min_n, self.max_n = min_n, max_n
+        self.codepoints = [ 32 ]        # 문자 id -> code point ( 0 은 phrase 구분자 )
+        self.char_index = {}            # code point -> 문자 id
+        self._chunks = []
+        self.seq = None
+
+    def subset( self, min_n, max_n ):
+        """ build 된 index 를 공유하면서 나열하는 길이만 다른 view ( e.g. bigram counter ) """
+        self._built()
+        _view = self.__class__.__new__( self.__class__ )
+        _view.__dict__.update( self.__dict__ )
+        _view.min_n, _view.max_n = min_n, max_n
+        return _view
+
+    def add_phrases( self, phrases ):
+        """ 공백 없는 phrase 들을 index 에 넣는다 ( 다음 조회 때 다시 build ) """
+        text = " ".join( phrases ) + " "
+        cps = np.frombuffer( text.encode( "utf-32-le" ), dtype=np.uint32 ).astype( np.int64 )
+        ucps, inv = np.unique( cps, return_inverse=True )
+        uids = np.empty( len( ucps ), dtype=np.int32 )
+        for i, cp in enumerate( ucps.tolist() ):
+            if cp == 32:
+                uids[i] = 0
+                continue
+            if cp not in self.char_index:
+                self.char_index[ cp ] = len( self.codepoints )
+                self.codepoints.append( cp )
+            uids[i] = self.char_index[ cp ]
+        self._chunks.append( uids[ inv.reshape( -1 ) ] )
+        self.seq = None
+        return self
+
+    def remove_phrases( self, phrases ):
+        """ phrase 들을 하나씩 빼고 남은 phrase 로 index 를 다시 만든다 ( 없는 phrase 는 무시. 문자 id 는 그대로 둔다 ) """
+        _removed = Counter( phrases )
+        seq = np.concatenate( self._chunks ) if self._chunks else np.zeros( 0, dtype=np.int32 )
+        text = np.asarray( self.codepoints, dtype=np.uint32 )[ seq ].tobytes().decode( "utf-32-le" )
+        kept = []
+        for phrase in text.split( " " ):
+            if not phrase:
+                continue
+            if _removed[ phrase ] > 0:
+                _removed[ phrase ] -= 1
+                continue
+            kept.append( phrase )
+        self._chunks = []
+        self.seq = None
+        return self.add_phrases( kept ) if kept else self
+
+    def build( self ):
+        seq = np.concatenate( self._chunks ) if self._chunks else np.zeros( 1, dtype=np.int32 )
+        self._chunks = [ seq ]
+        self.seq = seq
+        self.sa = self.__class__._suffix_array( seq )
+        self.rank = np.empty( len( seq ), dtype=np.int32 )
+        self.rank[ self.sa ] = np.arange( len( seq ), dtype=np.int32 )
+        # 각 위치에서 구분자까지 남은 글자 수
+        seps = np.flatnonzero( seq == 0 )
+        self.reach = ( seps[ np.searchsorted( seps, np.arange( len( seq ) ) ) ] - np.arange( len( seq ) ) ).astype( np.int32 )
+        # 길이를 늘려 가며 구하는 lcp 와 level 표 ( subset view 와 공유 )
+        self._cache = { "lcp": np.zeros( len( seq ), dtype=np.int32 ), "lcp_n": 0, "levels": {} }
+        return self
+
+    def save( self, path ):
+        """ build 된 배열을 path 폴더에 .npy 파일로 저장한다 ( lcp 와 level 표는 읽은 뒤 다시 구한다 ) """
+        self._built()
+        arrays = { "codepoints": np.asarray( self.codepoints, dtype=np.int64 ), "seq": self.seq, "sa": self.sa, "rank": self.rank, "reach": self.reach }
+        Tools.save_arrays( path, arrays, { "min_n": self.min_n, "max_n": self.max_n } )
+        return self
+
+    @classmethod
+    def load( cls, path, mmap_mode="c" ):
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        index = cls( meta["min_n"], meta["max_n"] )
+        index.codepoints = arrays["codepoints"].tolist()
+        index.char_index = { cp: i for i, cp in enumerate( index.codepoints ) if i > 0 }
+        index.seq, index.sa, index.rank, index.reach = arrays["seq"], arrays["sa"], arrays["rank"], arrays["reach"]
+        index._chunks = [ index.seq ]
+        index._cache = { "lcp": np.zeros( len( index.seq ), dtype=np.int32 ), "lcp_n": 0, "levels": {} }
+        return index
+
+    def _built( self ):
+        if self.seq is None:
+            self.build()
+        return self
+
+    def _suffix_array( seq ):
+        """ prefix doubling ( 정렬 key : 앞 k 글자의 rank, 다음 k 글자의 rank ) """
+        size = len( seq )
+        rank = seq.astype( np.int64 )
+        k = 1
+        while True:
+            rank2 = np.full( size, -1, dtype=np.int64 )
+            rank2[:size-k] = rank[k:]
+            sa = np.lexsort( ( rank2, rank ) )
+            r1, r2 = rank[ sa ], rank2[ sa ]
+            diff = np.concatenate( [ [ 0 ], ( ( r1[1:] != r1[:-1] ) | ( r2[1:] != r2[:-1] ) ).astype( np.int64 ) ] )
+            rank = np.empty( size, dtype=np.int64 )
+            rank[ sa ] = np.cumsum( diff )
+            if rank.max() == size - 1 or k >= size:
+                return sa.astype( np.int32 )
+            k *= 2
+
+    def lcp( self, n ):
+        """ SA 에서 이웃한 suffix 의 공통 접두 길이 ( 구분자 전까지, n 에서 자름 ). 길이를 하나씩 늘리며 cache 한다 """
+        self._built()
+        lcp = self._cache["lcp"]
+        while self._cache["lcp_n"] < n:
+            k = self._cache["lcp_n"]
+            a, b = self.sa[:-1], self.sa[1:]
+            cand = np.flatnonzero( lcp[1:] == k )
+            pa, pb = a[ cand ] + k, b[ cand ] + k
+            ok = ( self.seq[ pa ] == self.seq[ pb ] ) & ( self.seq[ pa ] != 0 )
+            lcp[ cand[ ok ] + 1 ] += 1
+            self._cache["lcp_n"] += 1
+        return np.minimum( lcp, n )
+
+    def groups( self, n ):
+        """ SA 순서의 각 suffix 가 속한 길이 n 의 n-gram id ( 앞 n 글자에 구분자가 있으면 -1 ) """
+        self._built()
+        valid = self.reach[ self.sa ] >= n
+        start = valid & ( self.lcp( n ) < n )
+        gids = np.cumsum( start ) - 1
+        gids[ ~valid ] = -1
+        return gids
+
+    def _level( self, n ):
+        """ 길이 n 의 n-gram 표 : SA 에서의 첫 위치, 빈도 """
+        self._built()
+        levels = self._cache["levels"]
+        if n not in levels:
+            gids = self.groups( n )
+            valid = gids >= 0
+            first = np.flatnonzero( valid & ( self.lcp( n ) < n ) )
+            counts = np.bincount( gids[ valid ], minlength=len( first ) ).astype( np.int64 )
+            levels[n] = ( first, counts )
+        return levels[n]
+
+    # 임의의 문자열 조회
+    def _range( self, token ):
+        """ token 으로 시작하는 suffix 들의 SA 구간 """
+        self._built()
+        chars = [ self.char_index.get( ord( c ), -1 ) for c in token ]
+        if not chars or min( chars ) < 1:
+            return ( 0, 0 )
+        target, m = tuple( chars ), len( chars )
+        lo, hi = 0, len( self.sa )
+        while lo < hi:
+            mid = ( lo + hi ) // 2
+            p = self.sa[ mid ]
+            if tuple( self.seq[ p:p+m ].tolist() ) < target: lo = mid + 1
+            else: hi = mid
+        start, hi = lo, len( self.sa )
+        while lo < hi:
+            mid = ( lo + hi ) // 2
+            p = self.sa[ mid ]
+            if tuple( self.seq[ p:p+m ].tolist() ) <= target: lo = mid + 1
+            else: hi = mid
+        return ( start, lo )
+
+    def freq( self, token ):
+        b, e = self._range( token )
+        return e - b
+
+    def neighbors( self, token, side="right" ):
+        """ token 의 오른쪽( side="right" ) 또는 왼쪽 이웃 문자 빈도 ( phrase 경계는 제외 ) """
+        b, e = self._range( token )
+        pos = self.sa[ b:e ].astype( np.int64 )
+        pos = pos + len( token ) if side == "right" else pos - 1
+        pos = pos[ ( pos >= 0 ) & ( pos < len( self.seq ) ) ]
+        chars = self.seq[ pos ]
+        chars = chars[ chars != 0 ]
+        cnt = np.bincount( chars, minlength=len( self.codepoints ) )
+        return Counter( { chr( self.codepoints[ c ] ): int( cnt[ c ] ) for c in np.flatnonzero( cnt ) } )
+
+    def branch_entropy( self, token ):
+        """ ( 오른쪽 이웃 분포의 entropy, 왼쪽 이웃 분포의 entropy ) """
+        rst = []
+        for side in ( "right", "left" ):
+            _freqs = list( self.neighbors( token, side ).values() )
+            total = sum( _freqs )
+            rst.append( sum( -1 * ( f / total ) * math.log2( f / total ) for f in _freqs ) if total else 0 )
+        return tuple( rst )
+
+    # n-gram 표 ( level n 의 id 는 SA 순서의 group 번호 )
+    def levels( self ):
+        return range( self.min_n, self.max_n + 1 )
+
+    def counts( self, n ):
+        return self._level( n )[1]
+
+    def positions( self, n, ids ):
+        """ level n id 들이 처음 나오는 corpus 위치 """
+        return self.sa[ self._level( n )[0][ ids ] ].astype( np.int64 )
+
+    def prefix_ids( self, n ):
+        """ level n 의 각 n-gram 에서 마지막 글자를 뺀 n-1 gram 의 id """
+        return self.groups( n - 1 )[ self._level( n )[0] ]
+
+    def suffix_ids( self, n ):
+        """ level n 의 각 n-gram 에서 첫 글자를 뺀 n-1 gram 의 id """
+        return self.groups( n - 1 )[ self.rank[ self.positions( n, np.arange( len( self.counts( n ) ) ) ) + 1 ] ]
+
+    def char_ids( self, n, ids ):
+        pos = self.positions( n, np.asarray( ids, dtype=np.int64 ) )
+        return self.seq[ pos[:, None] + np.arange( n ) ].astype( np.int64 )
+
+    def decode( self, n, ids ):
+        chars = self.char_ids( n, ids )
+        text = np.asarray( self.codepoints, dtype=np.uint32 )[ chars ].tobytes().decode( "utf-32-le" )
+        return [ text[i:i+n] for i in range( 0, len( text ), n ) ]
+
+    def ids( self, tokens ):
+        """ token 들의 level id ( 없으면 -1 ) """
+        rst = []
+        for token in tokens:
+            b, e = self._range( token )
+            rst.append( np.searchsorted( self._level( len( token ) )[0], b, side="right" ) - 1 if e > b else -1 )
+        return np.asarray( rst, dtype=np.int64 )
+
+    # Counter 와 같은 읽기 interface ( 조회는 길이 제한 없음 )
+    def __getitem__( self, token ):
+        return self.freq( token ) if token else 0
+
+    def __contains__( self, token ):
+        return isinstance( token, str ) and self[ token ] > 0
+
+    def get( self, token, default=None ):
+        return self[ token ] if token in self else default
+
+    def __iter__( self ):
+        for token, count in self.items():
+            yield token
+
+    def __len__( self ):
+        return sum( len( self.counts( n ) ) for n in self.levels() )
+
+    def items( self ):
+        for n in self.levels():
+            counts = self.counts( n )
+            for token, count in zip( self.decode( n, np.arange( len( counts ) ) ), counts.tolist() ):
+                yield ( token, count )
+
+    def keys( self ):
+        return iter( self )
+
+    def values( self ):
+        for n in self.levels():
+            for count in self.counts( n ).tolist():
+                yield count
+
+    def most_common( self, k=None ):
+        return sorted( self.items(), key=lambda x: x[1], reverse=True )[:k]
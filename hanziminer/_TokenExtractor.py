@@ -1,54 +1,40 @@
 # -*- encoding:utf8 -*-
 
-from collections import defaultdict, namedtuple, Counter
-import math
-from hanziminer import Corpus, Tools
+from collections import Counter
+from itertools import islice
+import multiprocessing
+import os
+import numpy as np
+from hanziminer import Corpus, Tools, NgramCounter, NgramValues, SuffixIndex, ScoreTable
 
 
 class TokenExtractor:
 
     _score_header = ['freq', 'cohesion_l', 'cohesion_r', 'cohesion', 'cohesion_s', 'branch_entropy_l', 'branch_entropy_r', 'branch_entropy' ]
+    _engines = ['counter', 'array', 'suffix']
+    _batch_size = 100000     # array, suffix engine 이 한 번에 넣는 phrase 수
+    _shard_size = 1000       # 병렬 학습에서 process 하나가 한 번에 세는 문서 수
 
     def __init__( self, corpus ):
         self.corpus = corpus
         self.token_counter = Counter()
-        self.unigram_counter = Counter( self.corpus.to_string() )
+        if self.corpus.streaming:
+            self.unigram_counter = Counter()
+            for doc in self.corpus.iter_texts():
+                self.unigram_counter.update( doc )
+        else:
+            self.unigram_counter = Counter( self.corpus.to_string() )
         self.bigram_counter = Counter()
 
-    def _cohesion_score( self, word ):
-        word_len = len( word )
-        if (not word) or ( word_len < self.min_window ):
-            return 0
-
-        first_chr_freq = self.unigram_counter[ word[0] ]
-        last_chr_freq = self.unigram_counter[ word[-1] ]
-        whole_word_freq = self.token_counter[ word ]
-
-        cohesion_l = 0 if whole_word_freq == 0 else math.pow( ( whole_word_freq / first_chr_freq ), (1 / (word_len - 1)) )
-        cohesion_r = 0 if whole_word_freq == 0 else math.pow( ( whole_word_freq / last_chr_freq ), (1 / (word_len - 1)) )
-        cohesion = math.sqrt(cohesion_l * cohesion_r)
-        return ( cohesion_l, cohesion_r, cohesion , (cohesion_l + cohesion_r)/2 )
-
-    def _branch_entropy_score( self, word ):
-        word_len = len( word )
-        whole_word_freq = self.token_counter[ word ]
-        token_l, token_r = word[:-1], word[1:]
-        branch_entropy_l = self.__class__.entropy( whole_word_freq / self.token_counter[token_l] ) if ( token_l in self.token_counter ) and (self.token_counter[token_l] != 0 ) else 0
-        branch_entropy_r = self.__class__.entropy( whole_word_freq / self.token_counter[token_r] ) if ( token_r in self.token_counter ) and (self.token_counter[token_r] != 0 ) else 0
-
-        # debuging ###
-        if not( ( token_l in self.token_counter ) and (self.token_counter[token_l] != 0 ) ):
-            print("token_l", word, token_l, self.token_counter[token_l] )
-
-        if not ( ( token_r in self.token_counter ) and (self.token_counter[token_r] != 0 ) ):
-            print("token_r", word, token_r, self.token_counter[token_r] )
-        ###
-
-        return ( ( token_l, branch_entropy_l ), ( token_r, branch_entropy_r ) )
-
    # return self
 
-    def train( self, min_freq = 5, min_window=2, max_window=8  ):
+    def train( self, min_freq = 5, min_window=2, max_window=8, engine="counter", workers=1 ):
+        """ engine : "counter" ( collections.Counter ), "array" ( NgramCounter : 문자를 정수 id 로 바꾸어 numpy 배열에 센다 )
+                 또는 "suffix" ( SuffixIndex : n-gram 을 세지 않고 suffix array 에서 조회. 학습 후에도 max_window 보다 긴 문자열의 통계를 구할 수 있다 )
+            workers : 2 이상이면 문서를 나누어 process pool 에서 세고 부분 빈도를 합친다 ( 빈도는 workers=1 과 같다 ) """
+        if engine not in self._engines:
+            raise ValueError( "engine must be one of {}".format( self._engines ) )
+        self.engine = engine
         self.min_freq = min_freq
         self.max_window = max_window
         if min_window < 2:
@@ -57,61 +43,291 @@ class TokenExtractor:
         else:
             self.min_window = min_window
 
-        corpus_size = len( self.corpus.to_list() )
+        # streaming corpus 는 문서를 하나씩 읽어 센다
+        docs = self.corpus.iter_docs() if self.corpus.streaming else self.corpus.to_list()
+        corpus_size = None if self.corpus.streaming else len( docs )
+
+        if self.engine == "array":
+            self.token_counter = NgramCounter( self.min_window - 1, max_window + 1 )
+            self.bigram_counter = self.token_counter.subset( 2, 2 )
+        elif self.engine == "suffix":
+            self.token_counter = SuffixIndex( self.min_window - 1, max_window + 1 )
+
+        if workers > 1 and self.engine == "suffix":
+            print("!!! Suffix engine builds one index over the whole corpus. workers is ignored")
+        elif workers > 1:
+            self._train_parallel( docs, workers )
+            self._total_branch_entropy_score()
+            print( "# Training was done. Used memory {:.3f} Gb".format( Tools.get_process_memory() ) )
+            return self
 
         print("# Training ... ")
-        for i, doc in enumerate( self.corpus.to_list() ):
-            Tools.print_progress(i+1, corpus_size, prefix='Progress', suffix='Complete')
+        n_docs = 0
+        _phrases = []
+        for n_docs, doc in enumerate( docs, 1 ):
+            if corpus_size: Tools.print_progress(n_docs, corpus_size, prefix='Progress', suffix='Complete')
+            else: Tools.print_counter(n_docs, prefix='Progress', suffix='documents')
+            if self.engine != "counter":
+                _phrases += doc
+                if len( _phrases ) >= self._batch_size:
+                    self.token_counter.add_phrases( _phrases )
+                    _phrases = []
+                continue
             for phrase in doc:
                 particles = Corpus.allgram( phrase, min_window- 1 , max_window + 1 ) # branch entropy를 구히기 위해 window 범위를 1씩 늘림
                 self.token_counter.update( Counter( particles ) )
 
                 bigrams = Corpus.ngram( phrase, n=2 )
                 self.bigram_counter.update( Counter( bigrams ) )
+        if _phrases:
+            self.token_counter.add_phrases( _phrases )
+        if self.engine == "suffix":
+            self.token_counter.build()
+            self.bigram_counter = self.token_counter.subset( 2, 2 )
+        if not corpus_size: Tools.print_counter(n_docs, prefix='Progress', suffix='documents', done=True)
 
         # Branch Entropy
         self._total_branch_entropy_score()
         print( "# Training was done. Used memory {:.3f} Gb".format( Tools.get_process_memory() ) )
         return self
 
+    def _train_parallel( self, docs, workers ):
+        """ 문서를 _shard_size 개씩 나누어 process pool 에서 세고, 부분 빈도를 크기가 같은 것끼리 합친다 ( tree-reduce ) """
+        _docs = iter( docs )
+        _shards = iter( lambda: list( islice( _docs, self._shard_size ) ), [] )
+        _args = ( self.engine, self.min_window - 1, self.max_window + 1 )
+        stack = []      # ( 합친 shard 수, 부분 빈도 )
+        n_shards = 0
+        print("# Training with {} workers ... ".format( workers ))
+        with multiprocessing.Pool( workers ) as pool:
+            while True:
+                # 한 번에 workers * 2 개의 shard 만 읽어 memory 를 제한한다
+                wave = [ ( shard, ) + _args for shard in islice( _shards, workers * 2 ) ]
+                if not wave: break
+                for part in pool.map( _count_shard, wave ):
+                    stack.append( ( 1, part ) )
+                    while len( stack ) > 1 and stack[-2][0] == stack[-1][0]:
+                        ( size, right ), ( _, left ) = stack.pop(), stack.pop()
+                        stack.append( ( size * 2, self.__class__._merge_counts( left, right ) ) )
+                n_shards += len( wave )
+                Tools.print_counter( n_shards, prefix='Progress', suffix='shards', every=1 )
+        Tools.print_counter( n_shards, prefix='Progress', suffix='shards', done=True )
+
+        merged = None
+        while stack:
+            merged = stack.pop()[1] if merged is None else self.__class__._merge_counts( stack.pop()[1], merged )
+        if self.engine == "array":
+            self.token_counter = merged if merged is not None else NgramCounter( self.min_window - 1, self.max_window + 1 )
+            self.bigram_counter = self.token_counter.subset( 2, 2 )
+        elif merged is not None:
+            self.token_counter, self.bigram_counter = merged
+        return self
+
+    def _merge_counts( left, right ):
+        if isinstance( left, NgramCounter ):
+            return left.merge( right )
+        left[0].update( right[0] )
+        left[1].update( right[1] )
+        return left
+
+    def _ngram_table( self ):
+        """ level 별 배열로 된 n-gram 표 ( counter engine 은 token_counter 를 NgramCounter 로 바꾼다 ) """
+        if self.engine == "counter":
+            return NgramCounter.from_counter( self.token_counter, self.min_window - 1, self.max_window + 1 )
+        return self.token_counter
+
     def _total_branch_entropy_score( self ):
-        branch_entropy_l = defaultdict(lambda: 0)
-        branch_entropy_r = defaultdict(lambda: 0)
-        for (w, f) in self.token_counter.items():
-            if ( len(w) < self.min_window ): continue
-            be_l, be_r = self._branch_entropy_score( w )
-            branch_entropy_l[ be_l[0] ] += be_l[1]
-            branch_entropy_r[ be_r[0] ] += be_r[1]
-        self.total_branch_entropy_l = branch_entropy_l
-        self.total_branch_entropy_r = branch_entropy_r
+        """ 길이 n 의 n-gram 을 n+1 gram 들의 부모( 앞 n 글자, 뒤 n 글자 )별로 묶어 좌우 이웃 분포의 entropy 를 한 번에 구한다
+        total_branch_entropy_l[x] : x 뒤에 이어지는 문자의 분포, total_branch_entropy_r[x] : x 앞에 오는 문자의 분포 """
+        table = self._ngram_table()
+        self._branch_stats = {}
+        _entropy_l, _entropy_r = {}, {}
+        for n in range( self.min_window, self.max_window + 1 ):
+            size = len( table.counts( n ) )
+            child_freq = table.counts( n + 1 )
+            stats_l = self.__class__.grouped_entropy_stats( table.prefix_ids( n + 1 ), child_freq, size )
+            stats_r = self.__class__.grouped_entropy_stats( table.suffix_ids( n + 1 ), child_freq, size )
+            self._branch_stats[n] = stats_l + stats_r
+            _entropy_l[n] = self.__class__.entropy_from_stats( *stats_l )
+            _entropy_r[n] = self.__class__.entropy_from_stats( *stats_r )
+        self._table = table
+        self.total_branch_entropy_l = NgramValues( table, _entropy_l )
+        self.total_branch_entropy_r = NgramValues( table, _entropy_r )
+        return self
+
+    @staticmethod
+    def grouped_entropy_stats( parent_ids, freq, size ):
+        """ 부모별 ( Σ f, Σ f·log2 f ). 부모 안에서는 빈도 순으로 더해 id 순서와 상관없이 같은 값이 나온다 """
+        ok = ( freq > 0 ) & ( parent_ids >= 0 )
+        parent_ids, freq = parent_ids[ ok ], freq[ ok ].astype( np.float64 )
+        order = np.lexsort( ( freq, parent_ids ) )
+        parent_ids, freq = parent_ids[ order ], freq[ order ]
+        total = np.bincount( parent_ids, weights=freq, minlength=size )
+        total_log = np.bincount( parent_ids, weights=freq * np.log2( freq ), minlength=size )
+        return ( total, total_log )
+
+    @staticmethod
+    def entropy_from_stats( total, total_log ):
+        """ H = -Σ (f/A) log2 (f/A) = log2 A - Σ f log2 f / A """
+        rst = np.zeros( len( total ) )
+        nz = total > 0
+        rst[ nz ] = np.log2( total[ nz ] ) - total_log[ nz ] / total[ nz ]
+        return np.maximum( rst, 0 )
+
+    def update( self, corpus_or_docs ):
+        """ 새 문서( Corpus, 문자열 list 또는 phrase list 의 list )를 빈도에 더하고 영향을 받는 점수만 다시 구한다
+            suffix engine 은 suffix array 를 부분 갱신할 수 없어 index 와 점수를 모두 다시 구한다 ( corpus 크기에 비례 ) """
+        return self._apply_delta( corpus_or_docs, 1 )
+
+    def remove( self, corpus_or_docs ):
+        """ 철회된 문서를 빈도에서 빼고 영향을 받는 점수만 다시 구한다
+            suffix engine 은 남은 phrase 로 index 를 다시 만든다 """
+        return self._apply_delta( corpus_or_docs, -1 )
+
+    def _apply_delta( self, corpus_or_docs, sign ):
+        if isinstance( corpus_or_docs, Corpus ):
+            texts = list( corpus_or_docs.iter_texts() )
+        else:
+            texts = [ doc if isinstance( doc, str ) else " ".join( doc ) for doc in corpus_or_docs ]
+        docs = [ text.split() for text in texts ]
+        unigram_delta = Counter()
+        for text in texts:
+            unigram_delta.update( text )
+        self.__class__._add_counter( self.unigram_counter, unigram_delta, sign )
+
+        if self.engine == "suffix":
+            # suffix array 는 부분 갱신이 되지 않아 index 를 다시 만든다
+            print("!!! Suffix engine rebuilds the whole index on {}".format( "update" if sign > 0 else "remove" ))
+            _phrases = [ phrase for doc in docs for phrase in doc ]
+            if sign > 0:
+                self.token_counter.add_phrases( _phrases )
+            else:
+                self.token_counter.remove_phrases( _phrases )
+            self.token_counter.build()
+            self.bigram_counter = self.token_counter.subset( 2, 2 )
+            self._total_branch_entropy_score()
+            if hasattr( self, "_score" ): self.extract()
+            return self
+
+        delta = _count_shard( ( docs, self.engine, self.min_window - 1, self.max_window + 1 ) )
+        if self.engine == "counter":
+            self.__class__._add_counter( self.token_counter, delta[0], sign )
+            self.__class__._add_counter( self.bigram_counter, delta[1], sign )
+            delta = NgramCounter.from_counter( delta[0], self.min_window - 1, self.max_window + 1 )
+        # array engine 은 _table 이 token_counter 자체이다
+        changes = self._table.add_counts( delta, sign )
+        if isinstance( self.bigram_counter, NgramCounter ) and self.bigram_counter.counts( 2 ) is not self._table.counts( 2 ):
+            # load() 한 counter engine 모델은 bigram 표를 따로 가진다
+            self.bigram_counter.add_counts( delta, sign )
+        affected = self._refresh_branch_entropy( changes )
+
+        if hasattr( self, "_score" ):
+            # 첫 글자나 끝 글자의 빈도가 바뀌면 cohesion 이 바뀐다
+            tokens = self._score.tokens
+            width = tokens.dtype.itemsize // 4
+            cps = tokens.view( np.uint32 ).reshape( -1, width )
+            lens = np.char.str_len( tokens )
+            changed = np.asarray( [ ord( c ) for c in unigram_delta ], dtype=np.uint32 )
+            hit = np.isin( cps[:, 0], changed ) | np.isin( cps[ np.arange( len( tokens ) ), np.maximum( lens - 1, 0 ) ], changed )
+            for n in range( self.min_window, self.max_window + 1 ):
+                ids = self._table.ids( tokens[ hit & ( lens == n ) ].tolist() )
+                if n in affected: ids = np.concatenate( [ ids, affected[n] ] )
+                self._refresh_scores( n, np.unique( ids[ ids >= 0 ] ) )
+        print( "# {} documents were {}. {} tokens were rescored".format( len( docs ), "added" if sign > 0 else "removed", sum( len( ids ) for ids in affected.values() ) ) )
+        return self
+
+    def _add_counter( counter, delta, sign ):
+        for k, v in delta.items():
+            counter[k] += sign * v
+            if counter[k] <= 0: del counter[k]
+
+    def _refresh_branch_entropy( self, changes ):
+        """ 빈도가 바뀐 n+1 gram 의 부모들만 ( Σ f, Σ f·log2 f ) 를 고쳐 entropy 를 다시 구한다. 점수를 다시 구할 level 별 id 를 돌려준다 """
+        table = self._table
+        affected = {}
+        for n in range( self.min_window, self.max_window + 1 ):
+            size = len( table.counts( n ) )
+            stats = [ np.concatenate( [ st, np.zeros( size - len( st ) ) ] ) for st in self._branch_stats[n] ]
+            for values in ( self.total_branch_entropy_l.values_by_level, self.total_branch_entropy_r.values_by_level ):
+                values[n] = np.concatenate( [ values[n], np.zeros( size - len( values[n] ) ) ] )
+            _affected = [ changes[n][0] ] if n in changes else []
+            if ( n + 1 ) in changes:
+                gids, before, after = changes[ n + 1 ]
+                d_total = ( after - before ).astype( np.float64 )
+                d_log = self.__class__._xlogx( after ) - self.__class__._xlogx( before )
+                for side, parent_ids in ( ( 0, table.prefix_ids( n + 1 )[ gids ] ), ( 2, table.suffix_ids( n + 1, gids ) ) ):
+                    ok = parent_ids >= 0
+                    np.add.at( stats[ side ], parent_ids[ ok ], d_total[ ok ] )
+                    np.add.at( stats[ side + 1 ], parent_ids[ ok ], d_log[ ok ] )
+                    parents = np.unique( parent_ids[ ok ] )
+                    values = ( self.total_branch_entropy_l if side == 0 else self.total_branch_entropy_r ).values_by_level[n]
+                    values[ parents ] = self.__class__.entropy_from_stats( stats[ side ][ parents ], stats[ side + 1 ][ parents ] )
+                    _affected.append( parents )
+            self._branch_stats[n] = tuple( stats )
+            if _affected:
+                affected[n] = np.unique( np.concatenate( _affected ) )
+        return affected
+
+    def _xlogx( x ):
+        x = np.asarray( x, dtype=np.float64 )
+        return np.where( x > 0, x * np.log2( np.maximum( x, 1 ) ), 0 )
+
+    def _refresh_scores( self, n, ids ):
+        """ level n 의 ids 만 점수를 다시 구한다 ( min_freq 아래로 내려간 token 은 뺀다 ) """
+        if len( ids ) == 0:
+            return self
+        tokens, columns, keep = self._score_columns( n, ids )
+        if keep.any():
+            self._score.set_rows( tokens[ keep ], { h: col[ keep ] for h, col in columns.items() } )
+        self._score.drop( tokens[ ~keep ] )
         return self
 
+    def _score_columns( self, n, ids ):
+        """ level n 의 ids 에 대한 ( token 배열, { 열 이름 : 점수 배열 }, min_freq 이상인지 ) 를 배열 연산으로 한 번에 구한다 """
+        table = self._table
+        freq = table.counts( n )[ ids ]
+        chars = table.char_ids( n, ids )
+        codepoints = np.asarray( table.codepoints, dtype=np.uint32 )
+        # token 을 code point 행렬에서 바로 고정 길이 unicode 배열로 만든다
+        cps = np.zeros( ( len( ids ), self.max_window ), dtype=np.uint32 )
+        cps[:, :n] = codepoints[ chars ]
+        tokens = cps.view( "<U{}".format( self.max_window ) ).reshape( -1 )
+        # Cohesion Score
+        unigram_freq = np.asarray( [ self.unigram_counter[ chr( cp ) ] for cp in table.codepoints ], dtype=np.float64 )
+        first_chr_freq, last_chr_freq = unigram_freq[ chars[:, 0] ], unigram_freq[ chars[:, -1] ]
+        with np.errstate( divide="ignore", invalid="ignore" ):
+            cohesion_l = np.where( freq > 0, np.power( freq / first_chr_freq, 1 / ( n - 1 ) ), 0 )
+            cohesion_r = np.where( freq > 0, np.power( freq / last_chr_freq, 1 / ( n - 1 ) ), 0 )
+        # Branch Entropy Score
+        branch_entropy_l = self.total_branch_entropy_l.values_by_level[n][ ids ]
+        branch_entropy_r = self.total_branch_entropy_r.values_by_level[n][ ids ]
+        columns = {
+            'freq': freq, 'cohesion_l': cohesion_l, 'cohesion_r': cohesion_r,
+            'cohesion': np.sqrt( cohesion_l * cohesion_r ), 'cohesion_s': ( cohesion_l + cohesion_r ) / 2,
+            'branch_entropy_l': branch_entropy_l, 'branch_entropy_r': branch_entropy_r,
+            'branch_entropy': ( branch_entropy_l + branch_entropy_r ) / 2
+        }
+        return ( tokens, columns, ( freq >= self.min_freq ) & ( freq > 0 ) )
+
     def score_header(self):
         return self._score_header
 
     def extract( self ):
-        self._score = defaultdict()
-        _score = namedtuple('Score', self._score_header )
-        self._token_counter_gt = { k: self.token_counter[k] for k in self.token_counter
-            if ( ( len(k) - self.max_window ) * ( len(k) - self.min_window ) <= 0 ) and self.token_counter[k] >= self.min_freq }
-
-        i = 0
-        total_len = len( self._token_counter_gt )
+        """ min_window ~ max_window 길이에서 min_freq 이상인 token 의 점수를 level 별 배열 연산으로 구해 ScoreTable 에 모은다 """
+        _tokens, _columns = [], { h: [] for h in self._score_header }
+        _levels = list( range( self.min_window, self.max_window + 1 ) )
         print("\r# Extracting ..." )
-        for (w, f) in self._token_counter_gt.items():
-
-            _freq = f
-            # Cohesion Score
-            _cohesion_l, _cohesion_r, _cohesion, _cohesion_s  = self._cohesion_score( w )
-            # Branch Entropy Score
-            _branch_entropy_l = self.total_branch_entropy_l[w]
-            _branch_entropy_r = self.total_branch_entropy_r[w]
-            _branch_entropy = ( _branch_entropy_l + _branch_entropy_r ) / 2
-            self._score[ w ] = _score( _freq, _cohesion_l, _cohesion_r, _cohesion, _cohesion_s, _branch_entropy_l, _branch_entropy_r, _branch_entropy )
+        for i, n in enumerate( _levels ):
+            freq = self._table.counts( n )
+            ids = np.flatnonzero( ( freq >= self.min_freq ) & ( freq > 0 ) )
+            tokens, columns, keep = self._score_columns( n, ids )
+            _tokens.append( tokens )
+            for h in self._score_header:
+                _columns[h].append( columns[h] )
 
             # Report progress
-            Tools.print_progress(i+1, total_len, prefix='Progress', suffix='Complete')
-            i += 1
+            Tools.print_progress(i+1, len( _levels ), prefix='Progress', suffix='Complete')
+        self._score = ScoreTable( self._score_header, np.concatenate( _tokens ), { h: np.concatenate( col ) for h, col in _columns.items() } )
 
         print("# Extrating was done. System memory {:.3f} Gb used".format( Tools.get_process_memory()) )
         return self
@@ -120,18 +336,81 @@ class TokenExtractor:
     def score(self):
         return self._score
 
+    def save( self, path ):
+        """ 학습한 상태( n-gram 표, unigram, bigram 빈도, branch entropy, 점수 )를 path 폴더에 .npy 파일로 저장한다 """
+        meta = { "engine": self.engine, "min_freq": self.min_freq, "min_window": self.min_window, "max_window": self.max_window }
+        arrays = {
+            "unigram_tokens": np.asarray( list( self.unigram_counter.keys() ), dtype=np.str_ ),
+            "unigram_counts": np.asarray( list( self.unigram_counter.values() ), dtype=np.int64 )
+        }
+        for n in range( self.min_window, self.max_window + 1 ):
+            arrays[ "branch_stats_{}".format( n ) ] = np.vstack( self._branch_stats[n] )
+            arrays[ "branch_entropy_l_{}".format( n ) ] = self.total_branch_entropy_l.values_by_level[n]
+            arrays[ "branch_entropy_r_{}".format( n ) ] = self.total_branch_entropy_r.values_by_level[n]
+        self._table.save( os.path.join( path, "table" ) )
+        if self.engine == "counter":
+            NgramCounter.from_counter( self.bigram_counter, 2, 2 ).save( os.path.join( path, "bigram" ) )
+        if hasattr( self, "_score" ):
+            self._score.save( os.path.join( path, "score" ) )
+        Tools.save_arrays( path, arrays, meta )
+        print("# Model was saved in {}".format( path ))
+        return self
+
+    @classmethod
+    def load( cls, path, mmap_mode="c" ):
+        """ save() 한 모델을 읽는다. 배열은 mmap 으로 열어 여러 process 가 한 벌을 나누어 쓰고, mmap_mode="c" 이면 update() 도 할 수 있다
+        counter engine 으로 학습한 모델은 token_counter 를 NgramCounter 로 읽어 array engine 이 된다 """
+        arrays, meta = Tools.load_arrays( path, mmap_mode )
+        extractor = cls.__new__( cls )
+        extractor.corpus = None
+        extractor.min_freq, extractor.min_window, extractor.max_window = meta["min_freq"], meta["min_window"], meta["max_window"]
+        extractor.unigram_counter = Counter( dict( zip( arrays["unigram_tokens"].tolist(), arrays["unigram_counts"].tolist() ) ) )
+        if meta["engine"] == "suffix":
+            extractor.engine = "suffix"
+            extractor.token_counter = SuffixIndex.load( os.path.join( path, "table" ), mmap_mode )
+        else:
+            extractor.engine = "array"
+            extractor.token_counter = NgramCounter.load( os.path.join( path, "table" ), mmap_mode )
+        if meta["engine"] == "counter":
+            extractor.bigram_counter = NgramCounter.load( os.path.join( path, "bigram" ), mmap_mode )
+        else:
+            extractor.bigram_counter = extractor.token_counter.subset( 2, 2 )
+        extractor._table = extractor.token_counter
+        extractor._branch_stats = {}
+        _entropy_l, _entropy_r = {}, {}
+        for n in range( extractor.min_window, extractor.max_window + 1 ):
+            extractor._branch_stats[n] = tuple( arrays[ "branch_stats_{}".format( n ) ] )
+            _entropy_l[n] = arrays[ "branch_entropy_l_{}".format( n ) ]
+            _entropy_r[n] = arrays[ "branch_entropy_r_{}".format( n ) ]
+        extractor.total_branch_entropy_l = NgramValues( extractor._table, _entropy_l )
+        extractor.total_branch_entropy_r = NgramValues( extractor._table, _entropy_r )
+        if os.path.isdir( os.path.join( path, "score" ) ):
+            extractor._score = ScoreTable.load( os.path.join( path, "score" ), mmap_mode )
+        print("# Model was loaded from {}".format( path ))
+        return extractor
+
     def report(self, output_filename, sep="\t", order="cohesion"):
         handler = open(output_filename, 'w', encoding="utf-8")
         header = "token" + sep + sep.join( self._score_header ) + "\n"
         handler.write(header)
 
-        _score_list = self.score().items()
-        score_list = sorted( _score_list, key=lambda x: getattr( x[1], order ), reverse=True )
-        for word, score in score_list:
-            handler.write( word + sep + sep.join( [ "{:01.3f}".format( getattr( score, s ) ) for s in self._score_header ]) + "\n" )
+        _order = np.argsort( -1 * self._score.column( order ), kind="stable" )
+        score_list = self._score.tokens[ _order ].tolist()
+        _columns = [ self._score.column( s )[ _order ].tolist() for s in self._score_header ]
+        for word, *score in zip( score_list, *_columns ):
+            handler.write( word + sep + sep.join( [ "{:01.3f}".format( s ) for s in score ]) + "\n" )
         handler.close()
         print("# {:d} of tokens were reported in {}".format( len( score_list) , output_filename  ) )
 
-    @staticmethod
-    def entropy( p ):
-        return -1 * p * math.log2( p )
+
+def _count_shard( args ):
+    """ process pool 에서 문서 묶음 하나의 n-gram 과 bigram 을 센다 """
+    docs, engine, min_n, max_n = args
+    if engine == "array":
+        return NgramCounter( min_n, max_n ).add_phrases( [ phrase for doc in docs for phrase in doc ] )
+    token_counter, bigram_counter = Counter(), Counter()
+    for doc in docs:
+        for phrase in doc:
+            token_counter.update( Corpus.allgram( phrase, min_n, max_n ) )
+            bigram_counter.update( Corpus.ngram( phrase, n=2 ) )
+    return ( token_counter, bigram_counter )
@@ -3,6 +3,47 @@
 import os
 import psutil
 import sys
+import yaml
+import numpy as np
+from collections import OrderedDict, namedtuple
+
+class LRUCache:
+    """ 크기가 정해진 LRU cache. get 할 때 hit / miss 를 센다 """
+
+    _info = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits, self.misses = 0, 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def cache_info(self):
+        return self._info(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def clear(self):
+        self.hits, self.misses = 0, 0
+        self._data.clear()
+
 
 class Tools:
     # Frome here : https://github.com/lovit/soynlp/tree/master/soynlp/utils
@@ -45,3 +86,32 @@ class Tools:
             sys.stdout.write('\n')
         sys.stdout.flush()
         # ref : https://gist.github.com/aubricus/f91fb55dc6ba5557fbab06119420dd6a
+
+    # Print iterations count ( total is unknown, e.g. streaming corpus )
+    def print_counter(iteration, prefix='Progress', suffix='documents', every=1000, done=False):
+        if done:
+            sys.stdout.write('\r%s %d %s\n' % (prefix, iteration, suffix))
+        elif iteration % every == 0:
+            sys.stdout.write('\r%s %d %s' % (prefix, iteration, suffix))
+        sys.stdout.flush()
+
+    # Save numpy arrays as a folder of .npy files ( and meta.yaml )
+    def save_arrays(path, arrays, meta=None):
+        os.makedirs(path, exist_ok=True)
+        for name, arr in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(arr), allow_pickle=False)
+        if meta is not None:
+            with open(os.path.join(path, 'meta.yaml'), 'w', encoding='utf-8') as f:
+                yaml.safe_dump(meta, f, allow_unicode=True)
+
+    # Load a folder saved by save_arrays. mmap_mode="r" or "c"( copy-on-write ) shares pages between processes
+    def load_arrays(path, mmap_mode='c'):
+        arrays = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith('.npy'):
+                arrays[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode=mmap_mode, allow_pickle=False)
+        meta = {}
+        if os.path.exists(os.path.join(path, 'meta.yaml')):
+            with open(os.path.join(path, 'meta.yaml'), encoding='utf-8') as f:
+                meta = yaml.safe_load(f)
+        return arrays, meta
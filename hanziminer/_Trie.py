@@ -0,0 +1,82 @@
+# -*- encoding:utf8 -*-
+
+
+class Trie:
+    """ 어휘 목록으로 만든 Aho-Corasick automaton
+    build() 한 뒤에는 문장을 왼쪽부터 한 번만 훑어 어휘에 있는 모든 부분 문자열을 찾는다 ( 문장 길이 + 찾은 수 에 비례 ).
+    token id 는 넣은 순서대로 붙는다 """
+
+    def __init__( self, tokens=() ):
+        self.tokens = []            # token id -> token
+        self.token_index = {}       # token -> token id
+        self._goto = [ {} ]         # node -> { 문자 : 다음 node }
+        self._term = [ -1 ]         # node 에서 끝나는 token id ( 없으면 -1 )
+        self._fail = [ 0 ]
+        self._out = [ 0 ]           # fail 을 따라가며 처음 만나는 token 이 끝나는 node ( 없으면 0 )
+        self._built = False
+        for token in tokens:
+            self.add( token )
+        self.build()
+
+    def add( self, token ):
+        """ token 을 넣고 token id 를 돌려준다 ( 다음 조회 때 다시 build ) """
+        if not token:
+            return -1
+        if token in self.token_index:
+            return self.token_index[ token ]
+        node = 0
+        for ch in token:
+            nxt = self._goto[ node ].get( ch )
+            if nxt is None:
+                nxt = len( self._goto )
+                self._goto[ node ][ ch ] = nxt
+                self._goto.append( {} )
+                self._term.append( -1 )
+            node = nxt
+        self._term[ node ] = self.token_index[ token ] = len( self.tokens )
+        self.tokens.append( token )
+        self._built = False
+        return self._term[ node ]
+
+    def build( self ):
+        """ 너비 우선으로 fail link 와 output link 를 만든다 """
+        size = len( self._goto )
+        self._fail, self._out = [ 0 ] * size, [ 0 ] * size
+        queue = list( self._goto[0].values() )
+        for node in queue:
+            for ch, nxt in self._goto[ node ].items():
+                f = self._fail[ node ]
+                while f and ch not in self._goto[ f ]:
+                    f = self._fail[ f ]
+                f = self._goto[ f ].get( ch, 0 )
+                self._fail[ nxt ] = f
+                self._out[ nxt ] = f if self._term[ f ] >= 0 else self._out[ f ]
+                queue.append( nxt )
+        self._built = True
+        return self
+
+    def find_all( self, text, min_len=1, max_len=None ):
+        """ text 안의 모든 어휘 출현을 ( 시작, 끝, token id ) 로 끝 위치 순서대로 돌려준다 """
+        if not self._built:
+            self.build()
+        goto, fail, term, out, tokens = self._goto, self._fail, self._term, self._out, self.tokens
+        rst = []
+        node = 0
+        for i, ch in enumerate( text ):
+            while node and ch not in goto[ node ]:
+                node = fail[ node ]
+            node = goto[ node ].get( ch, 0 )
+            o = node if term[ node ] >= 0 else out[ node ]
+            while o:
+                tid = term[ o ]
+                size = len( tokens[ tid ] )
+                if size >= min_len and ( max_len is None or size <= max_len ):
+                    rst.append( ( i + 1 - size, i + 1, tid ) )
+                o = out[ o ]
+        return rst
+
+    def __contains__( self, token ):
+        return token in self.token_index
+
+    def __len__( self ):
+        return len( self.tokens )
@@ -1,7 +1,11 @@
 # encoding: utf-8
 
-from ._Tools import Tools
+from ._Tools import Tools, LRUCache
 from ._Corpus import Corpus
+from ._NgramCounter import NgramCounter, NgramValues
+from ._SuffixIndex import SuffixIndex
+from ._ScoreTable import ScoreTable
+from ._Trie import Trie
 from ._TokenExtractor import TokenExtractor
 from ._Segmenter import *
-from ._COQuantifier import COQuantifier
+from ._COQuantifier import COQuantifier, COQuantifierWindow
@@ -7,6 +7,8 @@ import codecs
 from collections import defaultdict
 
 import networkx as nx
+import numpy as np
+import scipy.sparse as sp
 from tqdm import tqdm
 
 MAX_LEN = 4
@@ -207,30 +209,74 @@ def reverse_max_match(text, dictionary, max_len):
     return result
 
 
-def cal_ebv(graph, epochs=30):
+def cal_ebv(graph, epochs=30, backend='sparse', tol=1e-8):
     """
     计算外部边界值
     :param graph:
     :type graph: nx.DiGraph
-    :param epochs:
+    :param epochs: 最大迭代次数
     :type epochs: int
+    :param backend: sparse( 稀疏矩阵幂迭代 )/python( 逐节点求和 )
+    :param tol: sparse时，lbv/rbv的最大变化小于tol即提前停止
     """
+    if backend == 'sparse':
+        return cal_ebv_sparse(graph, epochs, tol)
+
     for epoch in range(epochs):
         print('epoch [%s]...' % (epoch+1))
 
         for node in graph.nodes:
-            graph.node[node]['lbv'] = sum([graph.nodes[lnode]['rbv'] for lnode in graph.predecessors(node)])
+            graph.nodes[node]['lbv'] = sum([graph.nodes[lnode]['rbv'] for lnode in graph.predecessors(node)])
 
         for node in graph.nodes:
-            graph.node[node]['rbv'] = sum([graph.nodes[rnode]['lbv'] for rnode in graph.successors(node)])
+            graph.nodes[node]['rbv'] = sum([graph.nodes[rnode]['lbv'] for rnode in graph.successors(node)])
 
-        lbv_norm = math.sqrt(sum(graph.node[node]['lbv'] ** 2 for node in graph.nodes))
-        rbv_norm = math.sqrt(sum(graph.node[node]['rbv'] ** 2 for node in graph.nodes))
+        lbv_norm = math.sqrt(sum(graph.nodes[node]['lbv'] ** 2 for node in graph.nodes)) or 1
+        rbv_norm = math.sqrt(sum(graph.nodes[node]['rbv'] ** 2 for node in graph.nodes)) or 1
 
         for node in graph.nodes:
-            graph.node[node]['lbv'] /= lbv_norm
-            graph.node[node]['rbv'] /= rbv_norm
-            graph.node[node]['ebv'] = graph.node[node]['lbv'] * graph.node[node]['rbv']
+            graph.nodes[node]['lbv'] /= lbv_norm
+            graph.nodes[node]['rbv'] /= rbv_norm
+            graph.nodes[node]['ebv'] = graph.nodes[node]['lbv'] * graph.nodes[node]['rbv']
+
+
+def cal_ebv_sparse(graph, epochs=30, tol=1e-8):
+    """
+    计算外部边界值，将graph转换为稀疏邻接矩阵A（A[i, j] = 1 表示 i -> j）后做HITS式幂迭代
+        lbv = A.T * rbv, rbv = A * lbv，再各自归一化
+    与python版本每轮结果相同，变化小于tol时提前停止
+    :param graph:
+    :type graph: nx.DiGraph
+    :param epochs: 最大迭代次数
+    :param tol:
+    :return: 迭代次数
+    """
+    nodes = list(graph.nodes)
+    adj = sp.csr_matrix(nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=None, dtype=np.float64, format='csr'))
+    adj_t = adj.T.tocsr()
+
+    lbv = np.array([graph.nodes[node].get('lbv', 1) for node in nodes], dtype=np.float64)
+    rbv = np.array([graph.nodes[node].get('rbv', 1) for node in nodes], dtype=np.float64)
+
+    epoch = 0
+    for epoch in range(1, epochs + 1):
+        new_lbv = adj_t.dot(rbv)
+        new_rbv = adj.dot(new_lbv)
+
+        new_lbv /= np.linalg.norm(new_lbv) or 1
+        new_rbv /= np.linalg.norm(new_rbv) or 1
+
+        delta = max(np.abs(new_lbv - lbv).max(initial=0), np.abs(new_rbv - rbv).max(initial=0))
+        lbv, rbv = new_lbv, new_rbv
+        print('epoch [%s]... delta %.3e' % (epoch, delta))
+        if delta < tol:
+            break
+
+    ebv = lbv * rbv
+    nx.set_node_attributes(graph, dict(zip(nodes, lbv.tolist())), 'lbv')
+    nx.set_node_attributes(graph, dict(zip(nodes, rbv.tolist())), 'rbv')
+    nx.set_node_attributes(graph, dict(zip(nodes, ebv.tolist())), 'ebv')
+    return epoch
 
 
 def cal_ibv(graph, grams):
@@ -256,7 +302,7 @@ def cal_ibv(graph, grams):
             pmi = math.log2(grams[word] * total / (grams[word1] * grams[word2]))
             pmis.append(pmi)
 
-        graph.node[node]['ibv'] = min(pmis)
+        graph.nodes[node]['ibv'] = min(pmis)
 
 
 def cal_rank(graph, f='exp', alpha=3.4):
@@ -282,7 +328,7 @@ def cal_rank(graph, f='exp', alpha=3.4):
 
     for word in graph.nodes:
         if len(word) > 1:
-            graph.node[word]['rank'] = graph.node[word]['ebv'] * f_fun(graph.node[word]['ibv'])
+            graph.nodes[word]['rank'] = graph.nodes[word]['ebv'] * f_fun(graph.nodes[word]['ibv'])
 
 
 def build(file_path, result_file_path):
@@ -302,7 +348,7 @@ def build(file_path, result_file_path):
 
     cal_rank(graph, alpha=5)
 
-    word_ranks = [{'word': word, 'rank': graph.node[word]['rank']} for word in graph.nodes if len(word) > 1]
+    word_ranks = [{'word': word, 'rank': graph.nodes[word]['rank']} for word in graph.nodes if len(word) > 1]
     word_ranks = sorted(word_ranks, key=lambda wr: wr['rank'], reverse=True)
 
     with codecs.open(result_file_path, mode='w', encoding='utf-8') as f: